@@ -4,11 +4,13 @@ from flask import Flask, abort, request, session
 
 from .config import Config
 from .db import DB
+from .json_provider import OrjsonProvider
 from flask_cors import CORS
 
 
 def create_app():
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
 
     app.config.from_object(Config)
 
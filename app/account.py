@@ -27,6 +27,7 @@ from app.models import product_review
 
 bp = Blueprint('account', __name__)
 PURCHASES_PAGE_SIZE = 10
+MY_REVIEWS_PAGE_SIZE = 50
 
 
 @bp.before_app_request
@@ -151,9 +152,8 @@ def register():
                 address=address,
             )
 
-        try:
-            user = User.create(email, full_name, address, password)
-        except IntegrityError:
+        user = User.create(email, full_name, address, password)
+        if user is None:
             flash('Email is already registered.', 'error')
             return render_template(
                 'account/register.html',
@@ -251,10 +251,7 @@ def account_edit():
                 flash(error, 'error')
             return render_template('account/account_edit.html', user=g.user)
 
-        if email != g.user.email and User.email_exists(email, exclude_user_id=g.user.id):
-            flash('That email is already registered to another account.', 'error')
-            return render_template('account/account_edit.html', user=g.user)
-
+        # idx_users_email_lower rejects a taken email in the UPDATE itself
         try:
             updated = User.update_profile(g.user.id, full_name, address, email=email)
         except IntegrityError:
@@ -415,10 +412,17 @@ def order_detail(order_id):
         abort(404)
     if order['buyer']['id'] != g.user.id:
         abort(403)
-    # Add review status for each line item
-    for item in order['line_items']:
-        item['product_review'] = product_review.get_user_review_for_product(g.user.id, item['product_id'])
-        item['seller_review'] = seller_review.get_user_review_for_seller(g.user.id, item['seller_id']) if item['seller_id'] else None
+    # Add review status for each line item (one lookup per review type)
+    line_items = order['line_items']
+    product_reviews = product_review.get_user_reviews_for_products(
+        g.user.id, [item['product_id'] for item in line_items]
+    )
+    seller_reviews = seller_review.get_user_reviews_for_sellers(
+        g.user.id, [item['seller_id'] for item in line_items if item['seller_id']]
+    )
+    for item in line_items:
+        item['product_review'] = product_reviews.get(item['product_id'])
+        item['seller_review'] = seller_reviews.get(item['seller_id']) if item['seller_id'] else None
         item['product_review_url'] = url_for('account.review_product', order_id=order['order_id'], product_id=item['product_id'])
         if item['seller_id']:
             item['seller_review_url'] = url_for('account.review_seller', order_id=order['order_id'], seller_id=item['seller_id'])
@@ -473,12 +477,17 @@ def api_user_purchases(user_id):
         'end_before': end_before,
     }
 
-    result = purchases.get_purchases_for_user(
-        user_id,
-        limit=per_page,
-        offset=offset,
-        **filter_kwargs,
-    )
+    after = request.args.get('after') or None
+    try:
+        result = purchases.get_purchases_for_user(
+            user_id,
+            limit=per_page,
+            offset=offset,
+            after=after,
+            **filter_kwargs,
+        )
+    except ValueError:
+        return jsonify({'error': 'invalid cursor'}), 400
     total_orders = result['total_orders']
     total_pages = max(1, math.ceil(total_orders / per_page)) if total_orders else 1
 
@@ -507,6 +516,7 @@ def api_user_purchases(user_id):
             'per_page': per_page,
             'total_orders': total_orders,
             'total_pages': total_pages,
+            'next_cursor': result['next_cursor'],
             'orders': serialized_orders,
         }
     )
@@ -709,17 +719,56 @@ def delete_seller_review(review_id):
     return redirect(next_url)
 
 
+def _format_review_cursor(cursor):
+    """Encode a review keyset cursor as a query-string value."""
+    if cursor is None:
+        return None
+    return ','.join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in cursor
+    )
+
+
+def _parse_review_cursor(raw):
+    """Decode a cursor from _format_review_cursor; invalid values start from the top."""
+    if not raw:
+        return None
+    parts = raw.split(',')
+    try:
+        created_at = datetime.fromisoformat(parts[-2])
+        cursor = (created_at, int(parts[-1]))
+        if len(parts) == 3:
+            cursor = (int(parts[0]),) + cursor
+        elif len(parts) != 2:
+            return None
+    except (IndexError, ValueError):
+        return None
+    return cursor
+
+
 @bp.route('/account/reviews')
 @login_required
 def my_reviews():
     sort = request.args.get('sort', 'date')
-    product_reviews = product_review.get_reviews_by_user(g.user.id, sort=sort)
-    seller_reviews = seller_review.get_reviews_by_user(g.user.id, sort=sort)
+    product_page = product_review.get_reviews_by_user(
+        g.user.id,
+        sort=sort,
+        limit=MY_REVIEWS_PAGE_SIZE,
+        cursor=_parse_review_cursor(request.args.get('product_after')),
+    )
+    seller_page = seller_review.get_reviews_by_user(
+        g.user.id,
+        sort=sort,
+        limit=MY_REVIEWS_PAGE_SIZE,
+        cursor=_parse_review_cursor(request.args.get('seller_after')),
+    )
 
     return render_template(
         'account/my_reviews.html',
-        product_reviews=product_reviews,
-        seller_reviews=seller_reviews,
+        product_reviews=product_page['reviews'],
+        seller_reviews=seller_page['reviews'],
+        product_next=_format_review_cursor(product_page['next_cursor']),
+        seller_next=_format_review_cursor(seller_page['next_cursor']),
         current_sort=sort,
     )
 
@@ -738,13 +787,10 @@ def vote_product_review(review_id):
 
     current_vote = product_review.get_user_vote(g.user.id, review_id)
     # if clicking same vote, remove it; otherwise set new vote
-    if current_vote == vote_value:
-        product_review.set_vote(g.user.id, review_id, 0)
-    else:
-        product_review.set_vote(g.user.id, review_id, vote_value)
+    new_vote = 0 if current_vote == vote_value else vote_value
+    product_review.set_vote(g.user.id, review_id, new_vote)
 
     counts = product_review.get_vote_counts(review_id)
-    new_vote = product_review.get_user_vote(g.user.id, review_id)
 
     return jsonify({
         'upvotes': counts['upvotes'],
@@ -767,13 +813,10 @@ def vote_seller_review(review_id):
 
     current_vote = seller_review.get_user_vote(g.user.id, review_id)
     # if clicking same vote, remove it; otherwise set new vote
-    if current_vote == vote_value:
-        seller_review.set_vote(g.user.id, review_id, 0)
-    else:
-        seller_review.set_vote(g.user.id, review_id, vote_value)
+    new_vote = 0 if current_vote == vote_value else vote_value
+    seller_review.set_vote(g.user.id, review_id, new_vote)
 
     counts = seller_review.get_vote_counts(review_id)
-    new_vote = seller_review.get_user_vote(g.user.id, review_id)
 
     return jsonify({
         'upvotes': counts['upvotes'],
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g
+
+
+class TTLCache:
+    """Bounded, process-local cache whose entries expire after ``ttl`` seconds.
+
+    Once ``maxsize`` entries are held, the least recently used one is evicted.
+    Each worker process keeps its own copy, so writers should ``pop`` (or
+    ``clear``) the entries they invalidate.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the live value for key, or default if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key, returning its value (expired or not) or default."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def per_request_cache(fn):
+    """Memoize a lookup on flask.g for the rest of the current request.
+
+    Each (function, positional args) pair hits the database at most once per
+    request, None results included; the store goes away with g, so nothing
+    outlives the request. Call ``fn.invalidate(*args)`` after writing the
+    underlying row.
+    """
+    name = fn.__qualname__
+
+    @wraps(fn)
+    def wrapper(*args):
+        store = g.setdefault('_request_cache', {})
+        cache_key = (name, args)
+        if cache_key not in store:
+            store[cache_key] = fn(*args)
+        return store[cache_key]
+
+    def invalidate(*args):
+        store = g.get('_request_cache')
+        if store:
+            store.pop((name, args), None)
+
+    wrapper.invalidate = invalidate
+    return wrapper
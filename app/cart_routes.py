@@ -146,5 +146,5 @@ def view_cart():
         return render_template('cart.html', items=[], total=0, user_id=None), 403
 
     items = get_cart_for_user(requested_id)
-    total = sum((item['quantity'] or 0) * (item['price'] or 0) for item in items)
+    total = sum((item['quantity'] or 0) * (item['price_cents'] or 0) for item in items) / 100
     return render_template('cart.html', items=items, total=total, user_id=requested_id)
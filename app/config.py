@@ -16,3 +16,10 @@ class Config(object):
                 DB_PORT,
                 DB_NAME)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_QUERY_CACHE_SIZE = int(os.environ.get('DB_QUERY_CACHE_SIZE') or 1200)
+    # werkzeug generate_password_hash method string, e.g. 'scrypt:32768:8:1'
+    # or 'pbkdf2:sha256:600000'; lets ops tune hashing cost per deployment
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine, text
+from sqlalchemy.sql.elements import TextClause
 
 
 class DB:
@@ -19,8 +20,19 @@ class DB:
 
     """
     def __init__(self, app):
+        # One engine per app; every engine.begin() checks a connection out of
+        # this pool instead of opening a new one. values_plus_batch lets psycopg2
+        # send multi-row INSERT/UPDATE executemany calls as batched pages.
+        # query_cache_size bounds the compiled-statement cache shared by the
+        # module-level text() constants in models/*.py.
         self.engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'],
-                                    execution_options={"isolation_level": "SERIALIZABLE"})
+                                    execution_options={"isolation_level": "SERIALIZABLE"},
+                                    pool_size=app.config.get('DB_POOL_SIZE', 10),
+                                    max_overflow=app.config.get('DB_MAX_OVERFLOW', 20),
+                                    pool_recycle=app.config.get('DB_POOL_RECYCLE', 1800),
+                                    pool_pre_ping=True,
+                                    query_cache_size=app.config.get('DB_QUERY_CACHE_SIZE', 1200),
+                                    executemany_mode='values_plus_batch')
 
     def execute(self, sqlstr, **kwargs):
         """Execute a single SQL statement sqlstr.
@@ -30,7 +42,9 @@ class DB:
         return the rows matched by the WHERE criterion of the UPDATE or DELETE statement;
         otherwise, return None.
         An exception will be raised for any error encountered.
-        sqlstr will be wrapped automatically in a sqlalchemy.sql.expression.TextClause.
+        sqlstr will be wrapped automatically in a sqlalchemy.sql.expression.TextClause;
+        hot paths may instead pass a TextClause built once at module level so
+        the statement is not rebuilt on every call.
         You can use :param inside sqlstr and supply its value as a kwarg.  See
         https://docs.sqlalchemy.org/en/14/core/connections.html#sqlalchemy.engine.execute
         https://docs.sqlalchemy.org/en/14/core/sqlelement.html#sqlalchemy.sql.expression.text
@@ -39,8 +53,26 @@ class DB:
         calling this function.
         """
         with self.engine.begin() as conn:
-            result = conn.execute(text(sqlstr), kwargs)
+            stmt = sqlstr if isinstance(sqlstr, TextClause) else text(sqlstr)
+            result = conn.execute(stmt, kwargs)
             if result.returns_rows:
                 return result.fetchall()
             else:
                 return result.rowcount
+
+    def execute_mappings(self, sqlstr, **kwargs):
+        """Execute a query sqlstr like execute(), but return each row as a
+        plain dict keyed by column name (use SQL aliases to pick the keys).
+        """
+        with self.engine.begin() as conn:
+            stmt = sqlstr if isinstance(sqlstr, TextClause) else text(sqlstr)
+            return [dict(row) for row in conn.execute(stmt, kwargs).mappings()]
+
+    def first(self, sqlstr, **kwargs):
+        """Execute a single-row query sqlstr and return its first row, or None.
+        Takes the same arguments as execute(), but reads one row instead of
+        building the full result list.
+        """
+        with self.engine.begin() as conn:
+            stmt = sqlstr if isinstance(sqlstr, TextClause) else text(sqlstr)
+            return conn.execute(stmt, kwargs).first()
@@ -1,7 +1,9 @@
 from flask import current_app as app
 from flask import Blueprint, jsonify, request, render_template, redirect, url_for, flash
-from app.models.inventory import get_inventory_for_user, add_product_to_inventory, update_product_quantity, remove_product_from_inventory, get_product_by_id, get_inventory_item, get_orders_for_seller, get_order_details, mark_line_item_as_fulfilled, get_order_analytics, get_top_buyers
+from app.models.inventory import get_inventory_for_user, add_product_to_inventory, update_product_quantity, remove_product_from_inventory, get_inventory_item_with_product, get_orders_for_seller, get_order_details, mark_line_item_as_fulfilled, get_order_analytics, get_top_buyers
+from app.models.product import clear_product_list_cache
 from math import ceil
+from datetime import datetime
 
 bp = Blueprint('inventory', __name__)
 
@@ -28,45 +30,32 @@ def add_product(user_id):
 
         # Check if product exists in Products
         rows = app.db.execute("""
-            SELECT id FROM Products WHERE name = :name
+            SELECT id FROM products WHERE name = :name
         """, name=name)
 
         if rows:
             product_id = rows[0][0]
         else:
-            app.db.execute("""
-                INSERT INTO Products (name, price, available)
+            rows = app.db.execute("""
+                INSERT INTO products (name, price, available)
                 VALUES (:name, :price, :available)
+                RETURNING id
             """, name=name, price=price, available=available)
 
-            rows = app.db.execute("""
-                SELECT id FROM Products WHERE name = :name
-            """, name=name)
-
             if not rows:
                 raise Exception("Product could not be created or fetched.")
 
             product_id = rows[0][0]
+            clear_product_list_cache()
 
-        # Check inventory duplicate
-        existing = app.db.execute("""
-            SELECT 1 FROM Inventory 
-            WHERE user_id = :uid AND product_id = :pid
-        """, uid=user_id, pid=product_id)
-
-        if existing:
+        # Add unless the seller already lists it
+        if not add_product_to_inventory(user_id, product_id, quantity):
             return render_template(
                 "add_product.html",
                 user_id=user_id,
                 error="This product is already in your inventory."
             )
 
-        # Otherwise add
-        app.db.execute("""
-            INSERT INTO Inventory (user_id, product_id, quantity)
-            VALUES (:uid, :pid, :qty)
-        """, uid=user_id, pid=product_id, qty=quantity)
-
         return redirect(url_for("inventory.view_inventory", user_id=user_id))
 
     return render_template("add_product.html", user_id=user_id)
@@ -86,17 +75,18 @@ def remove_product(user_id, product_id):
 
 @bp.route('/users/<int:user_id>/inventory/<int:product_id>/edit', methods=['GET', 'POST'])
 def edit_product(user_id, product_id):
-    product = get_product_by_id(product_id) 
-    inventory_item = get_inventory_item(user_id, product_id) 
-
     if request.method == 'POST':
         new_quantity = int(request.form['quantity'])
         update_product_quantity(user_id, product_id, new_quantity)
         return redirect(url_for('inventory.view_inventory', user_id=user_id))
-    
+
+    inventory_item = get_inventory_item_with_product(user_id, product_id)
+    if inventory_item is None:
+        flash("Product not found in your inventory.", "danger")
+        return redirect(url_for('inventory.view_inventory', user_id=user_id))
+
     return render_template('edit_product.html', 
                            user_id=user_id, 
-                           product=product, 
                            inventory_item=inventory_item)
 
 # INVENTORY ANALYTICS
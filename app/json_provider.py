@@ -0,0 +1,47 @@
+from datetime import date
+from decimal import Decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+
+# Sorted keys, stringified non-str keys and HTTP dates keep the output the
+# same as Flask's DefaultJSONProvider
+_DUMPS_OPTIONS = (
+    orjson.OPT_SORT_KEYS
+    | orjson.OPT_NON_STR_KEYS
+    | orjson.OPT_PASSTHROUGH_DATETIME
+)
+
+
+def _default(o):
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, Decimal):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+class OrjsonProvider(JSONProvider):
+    """App-wide JSON provider backed by orjson's C encoder."""
+
+    def dumps_bytes(self, obj, option=0):
+        """Serialize straight to UTF-8 bytes, skipping the str round trip."""
+        return orjson.dumps(obj, default=_default, option=_DUMPS_OPTIONS | option)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # jsonify() bodies go out as orjson's bytes; trailing newline as in Flask's default
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            self.dumps_bytes(obj, option=orjson.OPT_APPEND_NEWLINE),
+            mimetype='application/json',
+        )
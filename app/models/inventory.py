@@ -1,21 +1,111 @@
+from functools import lru_cache
+
 from flask import current_app as app
 from sqlalchemy import text
 
+from app.cache import per_request_cache
+from app.models.product import clear_product_list_cache
+
+
+_SQL_INVENTORY_PAGE = text("""
+    SELECT
+        i.product_id,
+        i.quantity,
+        p.name,
+        p.price,
+        p.available
+    FROM inventory i
+    JOIN products p ON i.product_id = p.id
+    WHERE i.user_id = :uid
+    ORDER BY p.name
+    LIMIT :per_page OFFSET :offset
+""")
+_SQL_INVENTORY_COUNT = text("""
+    SELECT COUNT(*) FROM inventory WHERE user_id = :uid
+""")
+_SQL_PRODUCT_BY_ID = text("""
+    SELECT id, name, price, available
+    FROM products
+    WHERE id = :pid
+""")
+_SQL_INVENTORY_ITEM = text("""
+    SELECT quantity
+    FROM inventory
+    WHERE user_id = :uid AND product_id = :pid
+""")
+_SQL_INVENTORY_ITEM_WITH_PRODUCT = text("""
+    SELECT i.product_id, i.quantity, p.name, p.price, p.available
+    FROM inventory i
+    JOIN products p ON p.id = i.product_id
+    WHERE i.user_id = :uid AND i.product_id = :pid
+""")
+_SQL_ADD_INVENTORY = text("""
+    INSERT INTO inventory (user_id, product_id, quantity)
+    VALUES (:uid, :pid, :qty)
+    ON CONFLICT (user_id, product_id) DO NOTHING
+    RETURNING 1
+""")
+_SQL_UPDATE_QUANTITY = text("""
+    UPDATE inventory
+    SET quantity = :quantity
+    WHERE user_id = :user_id AND product_id = :product_id
+    RETURNING 1
+""")
+_SQL_REMOVE_INVENTORY = text("""
+    DELETE FROM inventory
+    WHERE user_id = :user_id AND product_id = :product_id
+      AND NOT EXISTS (
+          SELECT 1 FROM order_items oi
+          WHERE oi.seller_id = :user_id
+            AND oi.product_id = :product_id
+            AND oi.fulfilled_at IS NULL
+      )
+    RETURNING 1
+""")
+_SQL_INVENTORY_EXISTS = text("""
+    SELECT 1 FROM inventory WHERE user_id = :user_id AND product_id = :product_id
+""")
+_SQL_ORDER_ANALYTICS = text("""
+    SELECT p.name, SUM(oi.quantity) AS total_sold
+    FROM order_items oi
+    JOIN products p ON oi.product_id = p.id
+    WHERE oi.seller_id = :uid
+    GROUP BY p.id
+    ORDER BY total_sold DESC
+    LIMIT 10
+""")
+_SQL_TOP_BUYERS = text("""
+    SELECT u.id, u.full_name,
+           COUNT(o.id) AS total_orders
+    FROM users u
+    JOIN orders o ON o.buyer_id = u.id
+    JOIN order_items oi ON oi.order_id = o.id
+    WHERE oi.seller_id = :uid
+    GROUP BY u.id
+    ORDER BY total_orders DESC
+    LIMIT :limit
+""")
+_SQL_ORDER_DETAILS = text("""
+    SELECT oi.id AS line_item_id, p.name AS product_name, oi.quantity, oi.unit_price_cents, oi.fulfilled_at
+    FROM order_items oi
+    JOIN products p ON oi.product_id = p.id
+    WHERE oi.seller_id = :seller_id AND oi.order_id = :order_id
+""")
+_SQL_FULFILL_LINE_ITEM = text("""
+    UPDATE order_items
+    SET fulfilled_at = NOW()
+    WHERE seller_id = :seller_id AND order_id = :order_id AND id = :line_item_id
+""")
+
+
+def _invalidate_inventory(user_id, product_id):
+    get_inventory_item.invalidate(user_id, product_id)
+    get_inventory_item_with_product.invalidate(user_id, product_id)
+
+
 def get_inventory_for_user(user_id, page=1, per_page=10):
     offset = (page - 1) * per_page
-    rows = app.db.execute("""
-        SELECT 
-            i.product_id,
-            i.quantity,
-            p.name,
-            p.price,
-            p.available
-        FROM Inventory i
-        JOIN Products p ON i.product_id = p.id
-        WHERE i.user_id = :uid
-        ORDER BY p.name
-        LIMIT :per_page OFFSET :offset
-    """, uid=user_id, per_page=per_page, offset=offset)
+    rows = app.db.execute(_SQL_INVENTORY_PAGE, uid=user_id, per_page=per_page, offset=offset)
     
     items = []
     for r in rows:
@@ -28,9 +118,7 @@ def get_inventory_for_user(user_id, page=1, per_page=10):
             "available": bool(available)
         })
     
-    total_rows = app.db.execute("""
-        SELECT COUNT(*) FROM Inventory WHERE user_id = :uid
-    """, uid=user_id)
+    total_rows = app.db.execute(_SQL_INVENTORY_COUNT, uid=user_id)
     
     total_count = total_rows[0][0] 
     
@@ -38,13 +126,10 @@ def get_inventory_for_user(user_id, page=1, per_page=10):
     
     return items, total_pages
 
+@per_request_cache
 def get_product_by_id(product_id):
     with app.db.engine.begin() as conn:
-        result = conn.execute(text("""
-            SELECT id, name, price, available
-            FROM Products
-            WHERE id = :pid
-        """), {"pid": product_id})
+        result = conn.execute(_SQL_PRODUCT_BY_ID, {"pid": product_id})
 
         product = result.fetchone()
 
@@ -52,13 +137,10 @@ def get_product_by_id(product_id):
             return product
         return None
 
+@per_request_cache
 def get_inventory_item(user_id, product_id):
     with app.db.engine.begin() as conn:
-        result = conn.execute(text("""
-            SELECT quantity 
-            FROM Inventory 
-            WHERE user_id = :uid AND product_id = :pid
-        """), {"uid": user_id, "pid": product_id})
+        result = conn.execute(_SQL_INVENTORY_ITEM, {"uid": user_id, "pid": product_id})
 
         inventory_item = result.fetchone()
 
@@ -66,109 +148,75 @@ def get_inventory_item(user_id, product_id):
             return inventory_item
         return None
 
+@per_request_cache
+def get_inventory_item_with_product(user_id, product_id):
+    """Return the seller's stock row for a product together with the product fields, or None."""
+    rows = app.db.execute(_SQL_INVENTORY_ITEM_WITH_PRODUCT, uid=user_id, pid=product_id)
+    if not rows:
+        return None
+    pid, qty, name, price, available = rows[0]
+    return {
+        "product_id": pid,
+        "quantity": qty,
+        "name": name,
+        "price": float(price) if price is not None else None,
+        "available": bool(available)
+    }
+
 #MANIPULATE INVENTORY FUNCTIONALITY
 def add_product_to_inventory(user_id, product_id, quantity):
+    _invalidate_inventory(user_id, product_id)
     with app.db.engine.begin() as conn:
-        result = conn.execute(text("""
-            SELECT quantity FROM Inventory 
-            WHERE user_id = :uid AND product_id = :pid
-        """), {"uid": user_id, "pid": product_id})
-
-        existing = result.fetchone()
-
-        if existing:
-            return False  
+        result = conn.execute(_SQL_ADD_INVENTORY, {"uid": user_id, "pid": product_id, "qty": quantity})
 
-        conn.execute(text("""
-            INSERT INTO Inventory (user_id, product_id, quantity) 
-            VALUES (:uid, :pid, :qty)
-        """), {"uid": user_id, "pid": product_id, "qty": quantity})
+        # No row back means the seller already lists this product
+        added = result.fetchone() is not None
 
-        return True
+    if added:
+        clear_product_list_cache()
+    return added
 
 def update_product_quantity(user_id, product_id, new_quantity):
+    _invalidate_inventory(user_id, product_id)
     with app.db.engine.begin() as conn:
-        result = conn.execute(text("""
-            SELECT quantity 
-            FROM Inventory 
-            WHERE user_id = :user_id AND product_id = :product_id
-        """), {"user_id": user_id, "product_id": product_id})
+        result = conn.execute(_SQL_UPDATE_QUANTITY, {"quantity": new_quantity, "user_id": user_id, "product_id": product_id})
 
-        existing = result.fetchone()
-
-        if not existing:
+        if result.fetchone() is None:
             return {"message": "Product not found in inventory"}, 404
 
-        conn.execute(text("""
-            UPDATE Inventory 
-            SET quantity = :quantity 
-            WHERE user_id = :user_id AND product_id = :product_id
-        """), {"quantity": new_quantity, "user_id": user_id, "product_id": product_id})
-
+    clear_product_list_cache()
     return {"message": "Product quantity updated successfully"}
 
-from sqlalchemy import text
-
 def remove_product_from_inventory(user_id, product_id):
+    _invalidate_inventory(user_id, product_id)
     with app.db.engine.begin() as conn:
-        # Check if product exists
-        result = conn.execute(text("""
-            SELECT 1 FROM Inventory WHERE user_id = :user_id AND product_id = :product_id
-        """), {"user_id": user_id, "product_id": product_id})
-        existing = result.fetchone()
-
-        if not existing:
-            return False, "Product not found in inventory."
+        # Delete unless the seller still has unfulfilled order items for it
+        result = conn.execute(_SQL_REMOVE_INVENTORY, {"user_id": user_id, "product_id": product_id})
+        removed = result.fetchone() is not None
 
-        # Check for outstanding order items for this seller/product
-        result = conn.execute(text("""
-            SELECT 1 FROM order_items oi
-            JOIN orders o ON o.id = oi.order_id
-            WHERE oi.seller_id = :user_id
-              AND oi.product_id = :product_id
-              AND oi.fulfilled_at IS NULL
-        """), {"user_id": user_id, "product_id": product_id})
-        outstanding = result.fetchone()
+    if removed:
+        clear_product_list_cache()
+        return True, "Product removed from inventory."
 
-        if outstanding:
-            raise Exception("Item cannot be removed. Fulfill outstanding orders first.")
-
-        # Safe to delete
-        conn.execute(text("""
-            DELETE FROM Inventory WHERE user_id = :user_id AND product_id = :product_id
-        """), {"user_id": user_id, "product_id": product_id})
+    # Nothing deleted: work out why
+    with app.db.engine.begin() as conn:
+        result = conn.execute(_SQL_INVENTORY_EXISTS, {"user_id": user_id, "product_id": product_id})
+        if result.fetchone() is None:
+            return False, "Product not found in inventory."
 
-    return True, "Product removed from inventory."
+    raise Exception("Item cannot be removed. Fulfill outstanding orders first.")
 
 
 #INVENTORY ANALYTICS
 def get_order_analytics(user_id):
-    rows = app.db.execute("""
-        SELECT p.name, SUM(oi.quantity) AS total_sold
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        WHERE oi.seller_id = :uid
-        GROUP BY p.id
-        ORDER BY total_sold DESC
-        LIMIT 10
-    """, uid=user_id)
+    rows = app.db.execute(_SQL_ORDER_ANALYTICS, uid=user_id)
     top_products = [{"name": r[0], "total_sold": r[1]} for r in rows]
 
     return top_products
 
 #SELLER ANALYTICS
 def get_top_buyers(user_id, limit=10):
-    rows = app.db.execute("""
-        SELECT u.id, u.full_name,
-               COUNT(o.id) AS total_orders
-        FROM users u
-        JOIN orders o ON o.buyer_id = u.id
-        JOIN order_items oi ON oi.order_id = o.id
-        WHERE oi.seller_id = :uid
-        GROUP BY u.id
-        ORDER BY total_orders DESC
-        LIMIT :limit
-    """, uid=user_id, limit=limit)
+    rows = app.db.execute(_SQL_TOP_BUYERS, uid=user_id, limit=limit)
 
     return [
         {"buyer_id": r[0], "name": r[1], "total_orders": r[2]}
@@ -176,65 +224,29 @@ def get_top_buyers(user_id, limit=10):
     ]
 
 #ORDER VIEWING/FULFILLMENT FUNCTIONALITY
-def get_orders_for_seller(
-    seller_id,
-    limit=10,
-    offset=0,
-    item_query=None,
-    seller_query=None,
-    start_date=None,
-    end_date=None,
-):
-    try:
-        limit_val = int(limit)
-    except (TypeError, ValueError):
-        limit_val = 10
-    limit_val = max(1, min(50, limit_val))
+# Optional seller-order filters: (bind parameter, predicate)
+_SELLER_ORDER_FILTERS = (
+    ('start_date', "o.created_at >= :start_date"),
+    ('end_date', "o.created_at <= :end_date"),
+    ('item_pattern', "p.name ILIKE :item_pattern"),
+    ('seller_pattern', "u.full_name ILIKE :seller_pattern"),
+)
 
-    try:
-        offset_val = int(offset)
-    except (TypeError, ValueError):
-        offset_val = 0
-    offset_val = max(0, offset_val)
 
+@lru_cache(maxsize=2 ** len(_SELLER_ORDER_FILTERS))
+def _seller_orders_statements(active):
+    """
+    Build (page, count) statements for one combination of active filters.
+    There are only 16 combinations, so each is built once and reused.
+    """
     conditions = ["oi.seller_id = :seller_id"]
-    params = {'seller_id': seller_id}
-
-    item_pattern = f"%{item_query.strip()}%" if item_query else None
-    seller_pattern = f"%{seller_query.strip()}%" if seller_query else None
-
-    if start_date:
-        conditions.append("o.created_at >= :start_date")
-        params['start_date'] = start_date
-    if end_date:
-        conditions.append("o.created_at <= :end_date")
-        params['end_date'] = end_date
-    if item_pattern:
-        conditions.append("p.name ILIKE :item_pattern")
-        params['item_pattern'] = item_pattern
-    if seller_pattern:
-        conditions.append("u.full_name ILIKE :seller_pattern")
-        params['seller_pattern'] = seller_pattern
-
+    conditions += [
+        predicate
+        for (_, predicate), on in zip(_SELLER_ORDER_FILTERS, active)
+        if on
+    ]
     where_clause = " AND ".join(conditions)
-
-    total_rows = app.db.execute(
-        f"""
-        SELECT COUNT(DISTINCT o.id)
-        FROM orders o
-        JOIN order_items oi ON oi.order_id = o.id
-        JOIN products p ON p.id = oi.product_id
-        LEFT JOIN users u ON u.id = o.buyer_id
-        WHERE {where_clause}
-        """,
-        **params,
-    )
-    total_orders = total_rows[0][0] if total_rows else 0
-    if total_orders == 0:
-        return [], total_orders
-
-    order_rows = app.db.execute(
-        f"""
+    page = text(f"""
         WITH filtered_line_items AS (
             SELECT
                 o.id AS order_id,
@@ -245,7 +257,7 @@ def get_orders_for_seller(
                 p.name AS product_name,
                 oi.quantity,
                 oi.unit_price_cents,
-                (oi.quantity * oi.unit_price_cents)::BIGINT AS line_total_cents,
+                oi.line_total_cents,
                 o.fulfilled,
                 oi.seller_id,
                 u.full_name AS buyer_name,
@@ -267,7 +279,7 @@ def get_orders_for_seller(
             GROUP BY order_id
         ),
         paged_orders AS (
-            SELECT order_id, order_created_at
+            SELECT order_id, order_created_at, COUNT(*) OVER () AS total_orders
             FROM order_summary
             ORDER BY order_created_at DESC, order_id DESC
             LIMIT :limit OFFSET :offset
@@ -278,75 +290,112 @@ def get_orders_for_seller(
             os.total_cents,
             os.item_count,
             os.all_fulfilled,
-            fli.order_item_id,
-            fli.product_id,
-            fli.product_name,
-            fli.quantity,
-            fli.unit_price_cents,
-            fli.line_total_cents,
-            fli.fulfilled,
-            fli.seller_id,
-            fli.buyer_name,
-            fli.buyer_address
+            po.total_orders,
+            MAX(fli.buyer_name) AS buyer_name,
+            MAX(fli.buyer_address) AS buyer_address,
+            jsonb_agg(
+                jsonb_build_object(
+                    'order_item_id', fli.order_item_id,
+                    'product_id', fli.product_id,
+                    'product_name', fli.product_name,
+                    'quantity', fli.quantity,
+                    'unit_price_cents', fli.unit_price_cents,
+                    'line_total_cents', fli.line_total_cents,
+                    'fulfilled', fli.fulfilled,
+                    'seller_id', fli.seller_id
+                )
+                ORDER BY fli.order_item_id
+            ) AS line_items
         FROM paged_orders po
         JOIN order_summary os ON os.order_id = po.order_id
         JOIN filtered_line_items fli ON fli.order_id = po.order_id
-        ORDER BY os.order_created_at DESC, po.order_id DESC, fli.order_item_id
-        """,
+        GROUP BY po.order_id, po.total_orders, os.order_created_at, os.total_cents, os.item_count, os.all_fulfilled
+        ORDER BY os.order_created_at DESC, po.order_id DESC
+    """)
+    count = text(f"""
+        SELECT COUNT(DISTINCT o.id)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        JOIN products p ON p.id = oi.product_id
+        LEFT JOIN users u ON u.id = o.buyer_id
+        WHERE {where_clause}
+    """)
+    return page, count
+
+
+def get_orders_for_seller(
+    seller_id,
+    limit=10,
+    offset=0,
+    item_query=None,
+    seller_query=None,
+    start_date=None,
+    end_date=None,
+):
+    try:
+        limit_val = int(limit)
+    except (TypeError, ValueError):
+        limit_val = 10
+    limit_val = max(1, min(50, limit_val))
+
+    try:
+        offset_val = int(offset)
+    except (TypeError, ValueError):
+        offset_val = 0
+    offset_val = max(0, offset_val)
+
+    params = {'seller_id': seller_id}
+    if start_date:
+        params['start_date'] = start_date
+    if end_date:
+        params['end_date'] = end_date
+    if item_query:
+        params['item_pattern'] = f"%{item_query.strip()}%"
+    if seller_query:
+        params['seller_pattern'] = f"%{seller_query.strip()}%"
+
+    page_stmt, count_stmt = _seller_orders_statements(
+        tuple(name in params for name, _ in _SELLER_ORDER_FILTERS)
+    )
+    order_rows = app.db.execute(
+        page_stmt,
         **params,
         limit=limit_val,
         offset=offset_val,
     )
 
-    orders = []
-    current_order = None
-    for row in order_rows:
-        order_id = row[0]
-        if not current_order or current_order['order_id'] != order_id:
-            current_order = {
-                'order_id': order_id,
-                'order_created_at': row[1],
-                'total_cents': row[2],
-                'item_count': int(row[3]),
-                'fulfilled': bool(row[4]),
-                'buyer_name': row[13],
-                'buyer_address': row[14],
-                'line_items': [],
-            }
-            orders.append(current_order)
-
-        current_order['line_items'].append(
-            {
-                'order_item_id': row[5],
-                'product_id': row[6],
-                'product_name': row[7],
-                'quantity': row[8],  
-                'unit_price_cents': row[9],
-                'line_total_cents': row[10],
-                'fulfilled': bool(row[11]),
-                'seller_id': row[12],
-            }
-        )
+    # One row per order; line items arrive already grouped as decoded JSON
+    orders = [
+        {
+            'order_id': row[0],
+            'order_created_at': row[1],
+            'total_cents': row[2],
+            'item_count': int(row[3]),
+            'fulfilled': bool(row[4]),
+            'buyer_name': row[6],
+            'buyer_address': row[7],
+            'line_items': row[8],
+        }
+        for row in order_rows
+    ]
+
+    if order_rows:
+        total_orders = int(order_rows[0][5])
+    elif offset_val == 0:
+        total_orders = 0
+    else:
+        # Paged past the end: the window count had no row to ride on
+        total_rows = app.db.execute(count_stmt, **params)
+        total_orders = total_rows[0][0] if total_rows else 0
 
     return orders, total_orders
 
 
 def get_order_details(seller_id, order_id):
-    query = """
-        SELECT oi.id AS line_item_id, p.name AS product_name, oi.quantity, oi.unit_price_cents, oi.fulfilled_at
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        WHERE oi.seller_id = :seller_id AND oi.order_id = :order_id
-    """
     with app.db.engine.begin() as conn:
-        result = conn.execute(text(query), {'seller_id': seller_id, 'order_id': order_id})
+        result = conn.execute(_SQL_ORDER_DETAILS, {'seller_id': seller_id, 'order_id': order_id})
         return result.fetchall()
 
 def mark_line_item_as_fulfilled(seller_id, order_id, line_item_id):
-    query = """
-        UPDATE order_items
-        SET fulfilled_at = NOW()
-        WHERE seller_id = :seller_id AND order_id = :order_id AND id = :line_item_id
-    """
     with app.db.engine.begin() as conn:
-        conn.execute(text(query), {'seller_id': seller_id, 'order_id': order_id, 'line_item_id': line_item_id})
\ No newline at end of file
+        conn.execute(_SQL_FULFILL_LINE_ITEM, {'seller_id': seller_id, 'order_id': order_id, 'line_item_id': line_item_id})
\ No newline at end of file
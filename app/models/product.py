@@ -1,12 +1,98 @@
 
-import time
 from flask import current_app as app
+from sqlalchemy import text
 
+from app.cache import TTLCache, per_request_cache
 
-_FEATURED_CACHE = {}
+
+_SQL_GET = text('''
+SELECT id, name, price, available
+FROM Products
+WHERE id = :id
+''')
+
+_SQL_GET_MANY = text('''
+SELECT id, name, price, available
+FROM Products
+WHERE id = ANY(:ids)
+''')
+
+_SQL_GET_ALL = text('''
+SELECT id, name, price, available, avg_rating
+FROM Products
+WHERE available = :available
+ORDER BY id
+''')
+
+_SQL_TOP_K_EXPENSIVE = text('''
+SELECT id, name, price, available, avg_rating
+FROM Products
+WHERE available = TRUE
+ORDER BY price DESC
+LIMIT :k
+''')
+
+# '%q%' ILIKE is served by the idx_products_name_trgm trigram index
+_SQL_SEARCH_BY_NAME = text('''
+SELECT id, name, price, available, avg_rating
+FROM Products
+WHERE available = TRUE
+  AND name ILIKE :pattern ESCAPE '\\'
+ORDER BY similarity(name, :q) DESC, id
+LIMIT :limit
+''')
+
+_SQL_FEATURED = text('''
+SELECT id, name, price, available, avg_rating
+FROM Products
+WHERE available = TRUE
+ORDER BY id
+LIMIT :limit
+''')
+
+_LIST_SORTED_SQL = '''
+SELECT id, name, price, available, avg_rating
+FROM Products
+WHERE available = :available
+ORDER BY {order_clause}
+LIMIT :limit OFFSET :offset
+'''
+
+# Whitelisted ORDER BY clauses for list_sorted; each rides an index on products
+_SQL_LIST_SORTED = {
+    sort: text(_LIST_SORTED_SQL.format(order_clause=order_clause))
+    for sort, order_clause in {
+        'az': 'LOWER(name), id',
+        'za': 'LOWER(name) DESC, id',
+        'price_low': 'price, id',
+        'price_high': 'price DESC, id',
+        'rating': 'avg_rating DESC NULLS LAST, id',
+        'available_only': 'id',
+        # In-stock first, tiebreaker by name
+        'availability': 'available DESC, LOWER(name), id',
+    }.items()
+}
+
+
+
+# Serialized payloads of the product list APIs, keyed by endpoint and its
+# normalized arguments; product, review and inventory writes clear it
+LIST_CACHE = TTLCache(maxsize=256, ttl=60)
+
+
+def clear_product_list_cache():
+    """Drop cached product list payloads after a write that changes them."""
+    LIST_CACHE.clear()
 
 
 class Product:
+    # Built in bulk from result rows; slots skip the per-instance __dict__
+    __slots__ = ('id', 'name', 'price', 'available', 'average_rating')
+
+    # Not stored on products; class-level defaults keep serializers attribute-only
+    image_url = None
+    description = None
+
     def __init__(self, id, name, price, available, average_rating=None):
         self.id = id
         self.name = name
@@ -15,37 +101,43 @@ class Product:
         self.average_rating = average_rating
 
     @staticmethod
+    @per_request_cache
     def get(id):
-        rows = app.db.execute('''
-SELECT id, name, price, available
-FROM Products
-WHERE id = :id
-''',
-                              id=id)
-        return Product(*(rows[0])) if rows is not None else None
+        row = app.db.first(_SQL_GET, id=id)
+        return Product(*row) if row else None
+
+    @staticmethod
+    def get_many(ids):
+        """Fetch several products in one query; returns a dict keyed by id."""
+        ids = list(set(ids))
+        if not ids:
+            return {}
+        rows = app.db.execute(_SQL_GET_MANY,
+                              ids=ids)
+        return {row[0]: Product(*row) for row in rows}
 
     @staticmethod
     def get_all(available=True):
-        rows = app.db.execute('''
-SELECT p.id, p.name, p.price, p.available, AVG(pr.rating) AS average_rating
-FROM Products p
-LEFT JOIN product_review pr ON pr.product_id = p.id
-WHERE p.available = :available
-GROUP BY p.id, p.name, p.price, p.available
-ORDER BY p.id
-''',
+        rows = app.db.execute(_SQL_GET_ALL,
                               available=available)
         return [Product(*row) for row in rows]
 
     @staticmethod
     def get_top_k_expensive(k):
-        rows = app.db.execute('''
-SELECT id, name, price, available
-FROM Products
-WHERE available = TRUE
-ORDER BY price DESC
-LIMIT :k
-''', k=k)
+        rows = app.db.execute(_SQL_TOP_K_EXPENSIVE, k=k)
+        return [Product(*row) for row in rows]
+
+    @staticmethod
+    def search_by_name(q, limit=100):
+        """Available products whose name contains q (case-insensitive), closest matches first."""
+        # Match q literally: escape the ILIKE wildcards and the escape character
+        escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = app.db.execute(
+            _SQL_SEARCH_BY_NAME,
+            pattern=f"%{escaped}%",
+            q=q,
+            limit=limit,
+        )
         return [Product(*row) for row in rows]
 
     @staticmethod
@@ -57,27 +149,21 @@ LIMIT :k
             limit_val = 20
         limit_val = max(1, min(100, limit_val))
 
-        cache_key = ('featured', limit_val)
-        now = time.monotonic()
-        cached = _FEATURED_CACHE.get(cache_key)
-        if cached and cached['expires_at'] > now:
-            return cached['rows']
-
+        # Served straight from idx_products_available_featured (index-only scan)
         rows = app.db.execute(
-            '''
-SELECT p.id, p.name, p.price, p.available, AVG(pr.rating) AS average_rating
-FROM Products p
-LEFT JOIN product_review pr ON pr.product_id = p.id
-WHERE p.available = TRUE
-GROUP BY p.id, p.name, p.price, p.available
-ORDER BY p.id
-LIMIT :limit
-''',
+            _SQL_FEATURED,
             limit=limit_val,
         )
-        result = [Product(*row) for row in rows]
-        _FEATURED_CACHE[cache_key] = {
-            'rows': result,
-            'expires_at': now + 60,  # small cache to reduce repeat homepage hits
-        }
-        return result
+        return [Product(*row) for row in rows]
+
+    @staticmethod
+    def list_sorted(sort='price_high', limit=None, offset=0, available=True):
+        """Products in a whitelisted order (default price_high); limit=None returns all rows."""
+        stmt = _SQL_LIST_SORTED.get(sort, _SQL_LIST_SORTED['price_high'])
+        rows = app.db.execute(
+            stmt,
+            available=available,
+            limit=limit,
+            offset=offset,
+        )
+        return [Product(*row) for row in rows]
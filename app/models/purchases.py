@@ -1,4 +1,217 @@
+import base64
+from datetime import datetime
+from functools import lru_cache
+
 from flask import current_app as app
+from sqlalchemy import text
+
+
+_SQL_PURCHASE_SUMMARY = text('''
+SELECT
+    COUNT(o.id) AS order_count,
+    COALESCE(SUM(o.total_cents), 0) AS total_cents,
+    MAX(o.created_at) AS last_order_at
+FROM orders o
+WHERE o.buyer_id = :user_id
+''')
+
+_SQL_RECENT_LINE_ITEMS = text('''
+SELECT
+    oi.id AS order_item_id,
+    o.id AS order_id,
+    o.created_at,
+    oi.product_id,
+    p.name AS product_name,
+    oi.quantity,
+    oi.unit_price_cents,
+    oi.line_total_cents
+FROM orders o
+JOIN order_items oi ON oi.order_id = o.id
+JOIN products p ON p.id = oi.product_id
+WHERE o.buyer_id = :user_id
+ORDER BY o.created_at DESC, o.id DESC, oi.id DESC
+LIMIT :limit
+''')
+
+_SQL_USER_ORDER_WITH_PRODUCT = text('''
+SELECT o.id AS order_id
+FROM orders o
+JOIN order_items oi ON oi.order_id = o.id
+WHERE o.buyer_id = :user_id AND oi.product_id = :product_id
+ORDER BY o.created_at DESC
+LIMIT 1
+''')
+
+_SQL_USER_ORDER_WITH_SELLER = text('''
+SELECT o.id AS order_id
+FROM orders o
+JOIN order_items oi ON oi.order_id = o.id
+WHERE o.buyer_id = :user_id AND oi.seller_id = :seller_id
+ORDER BY o.created_at DESC
+LIMIT 1
+''')
+
+_SQL_ORDER_DETAIL = text('''
+SELECT
+    o.id,
+    o.buyer_id,
+    o.created_at,
+    o.fulfilled,
+    o.total_cents,
+    u.full_name,
+    u.address,
+    u.email,
+    (
+        SELECT COALESCE(json_agg(li ORDER BY li.id), '[]'::json)
+        FROM (
+            SELECT
+                oi.id,
+                oi.product_id,
+                p.name AS product_name,
+                oi.seller_id,
+                seller.full_name AS seller_name,
+                oi.quantity,
+                oi.unit_price_cents,
+                oi.line_total_cents,
+                oi.fulfilled_at
+            FROM order_items oi
+            JOIN products p ON p.id = oi.product_id
+            LEFT JOIN users seller ON seller.id = oi.seller_id
+            WHERE oi.order_id = o.id
+        ) li
+    ) AS line_items
+FROM orders o
+LEFT JOIN users u ON u.id = o.buyer_id
+WHERE o.id = :order_id
+''')
+
+
+_PURCHASE_FILTERS = (
+    # (param, level, predicate): order-level filters restrict orders directly,
+    # line-level ones decide which line items (and therefore orders) match.
+    ('start_at', 'order', "o.created_at >= :start_at"),
+    ('end_before', 'order', "o.created_at < :end_before"),
+    ('item_pattern', 'line', "p.name ILIKE :item_pattern"),
+    ('seller_id', 'line', "oi.seller_id = :seller_id"),
+    ('seller_pattern', 'line', "s.full_name ILIKE :seller_pattern"),
+)
+
+
+@lru_cache(maxsize=2 ** (len(_PURCHASE_FILTERS) + 1))
+def _purchase_statements(active, keyset=False):
+    """
+    Build (page, count) statements for one combination of active filters.
+    There are only 32 combinations (times offset/keyset paging), so each is
+    built once and reused.
+
+    Keyset pages seek past (:after_created_at, :after_order_id) on
+    idx_orders_buyer_created instead of discarding OFFSET rows, and skip the
+    window count, which would have to visit every matching order anyway.
+    """
+    order_conditions = ["o.buyer_id = :user_id"]
+    line_conditions = ["TRUE"]
+    for (_, level, predicate), on in zip(_PURCHASE_FILTERS, active):
+        if on:
+            (order_conditions if level == 'order' else line_conditions).append(predicate)
+
+    # The existence check only joins the tables its active filters touch
+    on = dict(zip((name for name, _, _ in _PURCHASE_FILTERS), active))
+    filter_joins = ""
+    if on['item_pattern']:
+        filter_joins += "\n      JOIN products p ON p.id = oi.product_id"
+    if on['seller_pattern']:
+        filter_joins += "\n      JOIN Users s ON s.id = oi.seller_id"
+
+    order_where = " AND ".join(order_conditions)
+    line_where = " AND ".join(line_conditions)
+    matching_order_where = f"""{order_where}
+  AND EXISTS (
+      SELECT 1
+      FROM order_items oi{filter_joins}
+      WHERE oi.order_id = o.id AND {line_where}
+  )"""
+
+    if keyset:
+        page_where = f"""{matching_order_where}
+  AND (o.created_at, o.id) < (:after_created_at, :after_order_id)"""
+        total_column = "NULL::BIGINT"
+        page_limit = "LIMIT :limit"
+    else:
+        page_where = matching_order_where
+        total_column = "COUNT(*) OVER ()"
+        page_limit = "LIMIT :limit OFFSET :offset"
+
+    # The stored rollups describe the whole order; once a line-level filter
+    # trims line_items, count and fulfil-check the lines actually returned.
+    if len(line_conditions) > 1:
+        count_columns = """li.item_count,
+    li.all_fulfilled"""
+    else:
+        count_columns = """mo.item_count,
+    mo.fulfilled AS all_fulfilled"""
+
+    page = text(f"""
+WITH matching_orders AS (
+    SELECT o.id, o.created_at, o.total_cents, o.item_count, o.fulfilled,
+           {total_column} AS total_orders
+    FROM orders o
+    WHERE {page_where}
+    ORDER BY o.created_at DESC, o.id DESC
+    {page_limit}
+)
+SELECT
+    mo.id,
+    mo.created_at,
+    mo.total_cents,
+    {count_columns},
+    li.line_items,
+    mo.total_orders
+FROM matching_orders mo
+CROSS JOIN LATERAL (
+    SELECT
+        jsonb_agg(
+            jsonb_build_object(
+                'product_id', oi.product_id,
+                'product_name', p.name,
+                'quantity', oi.quantity,
+                'unit_price_cents', oi.unit_price_cents,
+                'line_total_cents', oi.line_total_cents,
+                'fulfilled', oi.fulfilled_at IS NOT NULL,
+                'seller_id', oi.seller_id,
+                'seller_name', s.full_name
+            )
+            ORDER BY oi.id
+        ) AS line_items,
+        COUNT(*) AS item_count,
+        COALESCE(BOOL_AND(oi.fulfilled_at IS NOT NULL), FALSE) AS all_fulfilled
+    FROM order_items oi
+    JOIN products p ON p.id = oi.product_id
+    LEFT JOIN Users s ON s.id = oi.seller_id
+    WHERE oi.order_id = mo.id AND {line_where}
+) li
+ORDER BY mo.created_at DESC, mo.id DESC
+""")
+    count = text(f"""
+SELECT COUNT(*)
+FROM orders o
+WHERE {matching_order_where}
+""")
+    return page, count
+
+
+def encode_purchase_cursor(created_at, order_id):
+    """Serialize an order's sort key as an opaque, URL-safe purchase-history cursor."""
+    raw = f"{created_at.isoformat()},{order_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_purchase_cursor(after):
+    """Inverse of encode_purchase_cursor; raises ValueError for a malformed cursor."""
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(after.encode()).decode().split(',')
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (TypeError, ValueError, UnicodeError) as exc:
+        raise ValueError('invalid purchase cursor') from exc
 
 
 def get_purchases_for_user(
@@ -10,8 +223,13 @@ def get_purchases_for_user(
     seller_name=None,
     start_at=None,
     end_before=None,
+    after=None,
 ):
-    """Return paginated orders with nested line items for a buyer, with optional filters."""
+    """Return paginated orders with nested line items for a buyer, with optional filters.
+
+    Pass the previous page's next_cursor as after to seek straight to the
+    following page; offset is then ignored and total_orders is None.
+    """
     try:
         limit_val = int(limit)
     except (TypeError, ValueError):
@@ -24,156 +242,81 @@ def get_purchases_for_user(
         offset_val = 0
     offset_val = max(0, offset_val)
 
-    # Build dynamic filters
-    conditions = ["o.buyer_id = :user_id"]
-    params = {'user_id': user_id}
-
-    item_pattern = f"%{item_query.strip()}%" if item_query else None
-    seller_pattern = f"%{seller_name.strip()}%" if seller_name else None
+    # An empty date window can't match anything; skip the round trip
+    if start_at is not None and end_before is not None and start_at >= end_before:
+        return {'orders': [], 'total_orders': 0, 'next_cursor': None}
 
+    params = {'user_id': user_id}
     if start_at is not None:
-        conditions.append("o.created_at >= :start_at")
         params['start_at'] = start_at
     if end_before is not None:
-        conditions.append("o.created_at < :end_before")
         params['end_before'] = end_before
-    if item_pattern:
-        conditions.append("p.name ILIKE :item_pattern")
-        params['item_pattern'] = item_pattern
+    if item_query:
+        params['item_pattern'] = f"%{item_query.strip()}%"
     if seller_id is not None:
-        conditions.append("oi.seller_id = :seller_id")
         params['seller_id'] = seller_id
-    if seller_pattern:
-        conditions.append("s.full_name ILIKE :seller_pattern")
-        params['seller_pattern'] = seller_pattern
+    if seller_name:
+        params['seller_pattern'] = f"%{seller_name.strip()}%"
 
-    where_clause = " AND ".join(conditions)
+    keyset = after is not None
+    if keyset:
+        params['after_created_at'], params['after_order_id'] = decode_purchase_cursor(after)
+        offset_val = 0
 
-    total_rows = app.db.execute(
-        f"""
-SELECT COUNT(DISTINCT o.id)
-FROM orders o
-JOIN order_items oi ON oi.order_id = o.id
-JOIN products p ON p.id = oi.product_id
-LEFT JOIN Users s ON s.id = oi.seller_id
-WHERE {where_clause}
-""",
-        **params,
+    page_stmt, count_stmt = _purchase_statements(
+        tuple(name in params for name, _, _ in _PURCHASE_FILTERS),
+        keyset,
     )
-    total_orders = total_rows[0][0] if total_rows else 0
-    if total_orders == 0:
-        return {'orders': [], 'total_orders': 0}
 
+    # Page over orders first, then join their line items exactly once
     order_rows = app.db.execute(
-        f"""
-WITH filtered_line_items AS (
-    SELECT
-        o.id AS order_id,
-        o.created_at,
-        o.total_cents,
-        oi.id AS order_item_id,
-        oi.product_id,
-        p.name AS product_name,
-        oi.quantity,
-        oi.unit_price_cents,
-        (oi.quantity * oi.unit_price_cents)::BIGINT AS line_total_cents,
-        (oi.fulfilled_at IS NOT NULL) AS fulfilled,
-        oi.seller_id,
-        s.full_name AS seller_name
-    FROM orders o
-    JOIN order_items oi ON oi.order_id = o.id
-    JOIN products p ON p.id = oi.product_id
-    LEFT JOIN Users s ON s.id = oi.seller_id
-    WHERE {where_clause}
-),
-order_summary AS (
-    SELECT
-        order_id,
-        MAX(created_at) AS order_created_at,
-        MAX(total_cents) AS total_cents,
-        COUNT(order_item_id) AS item_count,
-        BOOL_AND(fulfilled) AS all_fulfilled
-    FROM filtered_line_items
-    GROUP BY order_id
-),
-paged_orders AS (
-    SELECT order_id, order_created_at
-    FROM order_summary
-    ORDER BY order_created_at DESC, order_id DESC
-    LIMIT :limit OFFSET :offset
-)
-SELECT
-    po.order_id,
-    os.order_created_at,
-    os.total_cents,
-    os.item_count,
-    os.all_fulfilled,
-    fli.product_id,
-    fli.product_name,
-    fli.quantity,
-    fli.unit_price_cents,
-    fli.line_total_cents,
-    fli.fulfilled,
-    fli.seller_id,
-    fli.seller_name
-FROM paged_orders po
-JOIN order_summary os ON os.order_id = po.order_id
-JOIN filtered_line_items fli ON fli.order_id = po.order_id
-ORDER BY os.order_created_at DESC, po.order_id DESC, fli.order_item_id
-""",
+        page_stmt,
         **params,
         limit=limit_val,
         offset=offset_val,
     )
 
-    orders = []
-    current_order = None
-    for row in order_rows:
-        order_id = row[0]
-        if not current_order or current_order['order_id'] != order_id:
-            current_order = {
-                'order_id': order_id,
-                'order_created_at': row[1],
-                'total_cents': row[2],
-                'item_count': int(row[3]),
-                'all_fulfilled': bool(row[4]),
-                'line_items': [],
-            }
-            orders.append(current_order)
+    # One row per order; line items arrive already grouped as decoded JSON
+    orders = [
+        {
+            'order_id': row[0],
+            'order_created_at': row[1],
+            'total_cents': row[2],
+            'item_count': int(row[3]),
+            'all_fulfilled': bool(row[4]),
+            'line_items': row[5],
+        }
+        for row in order_rows
+    ]
 
-        current_order['line_items'].append(
-            {
-                'product_id': row[5],
-                'product_name': row[6],
-                'quantity': row[7],
-                'unit_price_cents': row[8],
-                'line_total_cents': row[9],
-                'fulfilled': bool(row[10]),
-                'seller_id': row[11],
-                'seller_name': row[12],
-            }
-        )
+    next_cursor = None
+    if len(orders) == limit_val:
+        last = orders[-1]
+        next_cursor = encode_purchase_cursor(last['order_created_at'], last['order_id'])
 
-    return {'orders': orders, 'total_orders': total_orders}
+    if keyset:
+        total_orders = None
+    elif order_rows:
+        total_orders = int(order_rows[0][6])
+    elif offset_val == 0:
+        total_orders = 0
+    else:
+        # Paged past the end: the window count had no row to ride on
+        total_rows = app.db.execute(count_stmt, **params)
+        total_orders = total_rows[0][0] if total_rows else 0
+
+    return {'orders': orders, 'total_orders': total_orders, 'next_cursor': next_cursor}
 
 
 def get_purchase_summary(user_id):
     """Return aggregate purchase metrics for displaying public stats."""
-    row = app.db.execute(
-        """
-SELECT
-    COUNT(o.id) AS order_count,
-    COALESCE(SUM(o.total_cents), 0) AS total_cents,
-    MAX(o.created_at) AS last_order_at
-FROM orders o
-WHERE o.buyer_id = :user_id
-""",
+    stats = app.db.first(
+        _SQL_PURCHASE_SUMMARY,
         user_id=user_id,
     )
-    if not row:
+    if not stats:
         return {'order_count': 0, 'total_cents': 0, 'last_order_at': None}
 
-    stats = row[0]
     return {
         'order_count': stats[0] or 0,
         'total_cents': stats[1] or 0,
@@ -189,55 +332,17 @@ def get_recent_line_items_for_user(user_id, limit=20):
         limit_val = 20
     limit_val = max(1, min(50, limit_val))
 
-    rows = app.db.execute(
-        """
-SELECT
-    oi.id AS order_item_id,
-    o.id AS order_id,
-    o.created_at,
-    oi.product_id,
-    p.name AS product_name,
-    oi.quantity,
-    oi.unit_price_cents,
-    (oi.quantity * oi.unit_price_cents)::BIGINT AS line_total_cents
-FROM orders o
-JOIN order_items oi ON oi.order_id = o.id
-JOIN products p ON p.id = oi.product_id
-WHERE o.buyer_id = :user_id
-ORDER BY o.created_at DESC, o.id DESC, oi.id DESC
-LIMIT :limit
-""",
+    return app.db.execute_mappings(
+        _SQL_RECENT_LINE_ITEMS,
         user_id=user_id,
         limit=limit_val,
     )
-    line_items = []
-    for row in rows:
-        line_items.append(
-            {
-                'order_item_id': row[0],
-                'order_id': row[1],
-                'created_at': row[2],
-                'product_id': row[3],
-                'product_name': row[4],
-                'quantity': row[5],
-                'unit_price_cents': row[6],
-                'line_total_cents': row[7],
-            }
-        )
-    return line_items
 
 
 def get_user_order_with_product(user_id, product_id):
     """Get the most recent order where user purchased a specific product."""
     rows = app.db.execute(
-        """
-SELECT o.id AS order_id
-FROM orders o
-JOIN order_items oi ON oi.order_id = o.id
-WHERE o.buyer_id = :user_id AND oi.product_id = :product_id
-ORDER BY o.created_at DESC
-LIMIT 1
-""",
+        _SQL_USER_ORDER_WITH_PRODUCT,
         user_id=user_id,
         product_id=product_id,
     )
@@ -249,14 +354,7 @@ LIMIT 1
 def get_user_order_with_seller(user_id, seller_id):
     """Get the most recent order where user ordered from a specific seller."""
     rows = app.db.execute(
-        """
-SELECT o.id AS order_id
-FROM orders o
-JOIN order_items oi ON oi.order_id = o.id
-WHERE o.buyer_id = :user_id AND oi.seller_id = :seller_id
-ORDER BY o.created_at DESC
-LIMIT 1
-""",
+        _SQL_USER_ORDER_WITH_SELLER,
         user_id=user_id,
         seller_id=seller_id,
     )
@@ -267,65 +365,31 @@ LIMIT 1
 
 def get_order_detail(order_id):
     """Return header + line items for a specific order, including seller and product names."""
-    header_rows = app.db.execute(
-        """
-SELECT
-    o.id,
-    o.buyer_id,
-    o.created_at,
-    o.fulfilled,
-    o.total_cents,
-    u.full_name,
-    u.address,
-    u.email
-FROM orders o
-LEFT JOIN users u ON u.id = o.buyer_id
-WHERE o.id = :order_id
-""",
+    header = app.db.first(
+        _SQL_ORDER_DETAIL,
         order_id=order_id,
     )
-    if not header_rows:
+    if not header:
         return None
 
-    header = header_rows[0]
-    line_rows = app.db.execute(
-        """
-SELECT
-    oi.id,
-    oi.product_id,
-    p.name,
-    oi.seller_id,
-    seller.full_name AS seller_name,
-    oi.quantity,
-    oi.unit_price_cents,
-    oi.fulfilled_at
-FROM order_items oi
-JOIN products p ON p.id = oi.product_id
-LEFT JOIN users seller ON seller.id = oi.seller_id
-WHERE oi.order_id = :order_id
-ORDER BY oi.id
-""",
-        order_id=order_id,
-    )
-
     computed_total = 0
     line_items = []
-    for row in line_rows:
-        quantity = row[5] or 0
-        unit_price = row[6] or 0
-        line_total = quantity * unit_price
+    for line in header[8]:
+        line_total = line['line_total_cents']
         computed_total += line_total
+        fulfilled_at = line['fulfilled_at']
         line_items.append(
             {
-                'order_item_id': row[0],
-                'product_id': row[1],
-                'product_name': row[2],
-                'seller_id': row[3],
-                'seller_name': row[4],
-                'quantity': quantity,
-                'unit_price_cents': unit_price,
+                'order_item_id': line['id'],
+                'product_id': line['product_id'],
+                'product_name': line['product_name'],
+                'seller_id': line['seller_id'],
+                'seller_name': line['seller_name'],
+                'quantity': line['quantity'],
+                'unit_price_cents': line['unit_price_cents'],
                 'line_total_cents': line_total,
-                'fulfilled_at': row[7],
+                # json_agg renders timestamps as ISO strings
+                'fulfilled_at': datetime.fromisoformat(fulfilled_at) if fulfilled_at else None,
             }
         )
 
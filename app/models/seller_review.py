@@ -1,27 +1,12 @@
+from functools import lru_cache
+
 from flask import current_app as app
 from sqlalchemy import text
 
+from app.cache import TTLCache
 
-def get_recent_reviews_for_seller(seller_id, limit=5, sort='date', top_helpful=3):
-    """Return reviews about a seller with vote counts.
 
-    By default shows top 3 most helpful first, then remaining by date.
-    Helpfulness score = upvotes - downvotes.
-    """
-    if sort == 'rating':
-        order_clause = 'sr.rating DESC, sr.created_at DESC'
-    elif sort == 'helpful':
-        order_clause = 'helpful_score DESC, sr.created_at DESC'
-    else:
-        # default: top N helpful first, then by date
-        order_clause = f'''
-            CASE WHEN row_num <= {int(top_helpful)} THEN 0 ELSE 1 END,
-            CASE WHEN row_num <= {int(top_helpful)} THEN helpful_score END DESC,
-            sr.created_at DESC
-        '''
-
-    rows = app.db.execute(
-        f'''
+_RECENT_REVIEWS_SQL = '''
 WITH review_votes AS (
     SELECT sr.id,
            sr.user_id AS reviewer_id,
@@ -31,62 +16,186 @@ WITH review_votes AS (
            sr.body,
            sr.created_at,
            sr.updated_at,
-           COALESCE(v.upvotes, 0) AS upvotes,
-           COALESCE(v.downvotes, 0) AS downvotes,
-           COALESCE(v.upvotes, 0) - COALESCE(v.downvotes, 0) AS helpful_score,
-           ROW_NUMBER() OVER (ORDER BY COALESCE(v.upvotes, 0) - COALESCE(v.downvotes, 0) DESC, sr.created_at DESC) AS row_num
+           sr.upvotes,
+           sr.downvotes,
+           sr.helpful_score,
+           ROW_NUMBER() OVER (ORDER BY sr.helpful_score DESC, sr.created_at DESC) AS row_num
     FROM seller_review sr
     JOIN users u ON u.id = sr.user_id
-    LEFT JOIN (
-        SELECT review_id,
-               SUM(CASE WHEN vote_value = 1 THEN 1 ELSE 0 END) AS upvotes,
-               SUM(CASE WHEN vote_value = -1 THEN 1 ELSE 0 END) AS downvotes
-        FROM seller_review_vote
-        GROUP BY review_id
-    ) v ON v.review_id = sr.id
     WHERE sr.seller_id = :seller_id
 )
 SELECT id, reviewer_id, reviewer_name, seller_id, rating, body,
-       created_at, updated_at, upvotes, downvotes, helpful_score, row_num
+       created_at, updated_at, upvotes, downvotes, helpful_score
 FROM review_votes sr
 ORDER BY {order_clause}
 LIMIT :limit
-''',
-        seller_id=seller_id,
-        limit=limit,
-    )
-    reviews = []
-    for row in rows:
-        reviews.append({
-            'id': row[0],
-            'reviewer_id': row[1],
-            'reviewer_name': row[2],
-            'seller_id': row[3],
-            'rating': row[4],
-            'body': row[5],
-            'created_at': row[6],
-            'updated_at': row[7],
-            'upvotes': row[8],
-            'downvotes': row[9],
-            'helpful_score': row[10],
-        })
-    return reviews
+'''
 
+# One fixed statement per sort; the default shows the top :top_helpful most
+# helpful reviews first, then the rest by date.
+_SQL_RECENT_REVIEWS = {
+    'rating': text(_RECENT_REVIEWS_SQL.format(
+        order_clause='sr.rating DESC, sr.created_at DESC')),
+    'helpful': text(_RECENT_REVIEWS_SQL.format(
+        order_clause='helpful_score DESC, sr.created_at DESC')),
+    'date': text(_RECENT_REVIEWS_SQL.format(order_clause='''
+    CASE WHEN row_num <= :top_helpful THEN 0 ELSE 1 END,
+    CASE WHEN row_num <= :top_helpful THEN helpful_score END DESC,
+    sr.created_at DESC''')),
+}
 
-def get_summary_for_seller(seller_id):
-    """Compute aggregate rating information for a seller."""
-    rows = app.db.execute(
-        '''
+_SQL_SUMMARY = text('''
 SELECT COUNT(*) AS review_count,
        AVG(rating) AS avg_rating,
        MIN(created_at) AS first_review_at,
        MAX(created_at) AS last_review_at
 FROM seller_review
 WHERE seller_id = :seller_id
-''',
+''')
+
+_SQL_USER_REVIEW = text('''
+SELECT sr.id, sr.user_id, sr.seller_id, sr.rating, sr.body, sr.created_at, sr.updated_at
+FROM seller_review sr
+WHERE sr.user_id = :user_id AND sr.seller_id = :seller_id
+''')
+
+_SQL_USER_REVIEWS_FOR_SELLERS = text('''
+SELECT sr.id, sr.user_id, sr.seller_id, sr.rating, sr.body, sr.created_at, sr.updated_at
+FROM seller_review sr
+WHERE sr.user_id = :user_id AND sr.seller_id = ANY(:seller_ids)
+''')
+
+_SQL_CREATE_REVIEW = text('''
+INSERT INTO seller_review (user_id, seller_id, rating, body)
+VALUES (:user_id, :seller_id, :rating, :body)
+RETURNING id, created_at, updated_at
+''')
+
+_SQL_UPDATE_REVIEW = text('''
+UPDATE seller_review
+SET rating = :rating, body = :body, updated_at = NOW()
+WHERE id = :review_id
+RETURNING id, user_id, seller_id, rating, body, created_at, updated_at
+''')
+
+_SQL_DELETE_REVIEW = text('DELETE FROM seller_review WHERE id = :review_id RETURNING id, seller_id')
+
+_SQL_REVIEW_BY_ID = text('''
+SELECT id, user_id, seller_id, rating, body, created_at, updated_at
+FROM seller_review
+WHERE id = :review_id
+''')
+
+_SQL_DELETE_VOTE = text('''
+DELETE FROM seller_review_vote
+WHERE user_id = :user_id AND review_id = :review_id
+''')
+
+_SQL_UPSERT_VOTE = text('''
+INSERT INTO seller_review_vote (user_id, review_id, vote_value)
+VALUES (:user_id, :review_id, :vote_value)
+ON CONFLICT (user_id, review_id)
+DO UPDATE SET vote_value = :vote_value, created_at = NOW()
+''')
+
+_SQL_REFRESH_VOTE_COUNTS = text('''
+UPDATE seller_review
+SET upvotes = v.upvotes, downvotes = v.downvotes
+FROM (
+    SELECT COUNT(*) FILTER (WHERE vote_value = 1) AS upvotes,
+           COUNT(*) FILTER (WHERE vote_value = -1) AS downvotes
+    FROM seller_review_vote
+    WHERE review_id = :review_id
+) v
+WHERE id = :review_id
+''')
+
+_SQL_DELETE_VOTES_BULK = text('''
+DELETE FROM seller_review_vote
+WHERE user_id = :user_id AND review_id = ANY(:review_ids)
+''')
+
+_SQL_UPSERT_VOTES_BULK = text('''
+INSERT INTO seller_review_vote (user_id, review_id, vote_value)
+SELECT :user_id, t.review_id, t.vote_value
+FROM UNNEST(CAST(:review_ids AS INT[]), CAST(:vote_values AS INT[])) AS t(review_id, vote_value)
+ON CONFLICT (user_id, review_id)
+DO UPDATE SET vote_value = EXCLUDED.vote_value, created_at = NOW()
+''')
+
+_SQL_REFRESH_VOTE_COUNTS_BULK = text('''
+UPDATE seller_review sr
+SET upvotes = v.upvotes, downvotes = v.downvotes
+FROM (
+    SELECT r.id,
+           COUNT(srv.review_id) FILTER (WHERE srv.vote_value = 1) AS upvotes,
+           COUNT(srv.review_id) FILTER (WHERE srv.vote_value = -1) AS downvotes
+    FROM UNNEST(CAST(:review_ids AS INT[])) AS r(id)
+    LEFT JOIN seller_review_vote srv ON srv.review_id = r.id
+    GROUP BY r.id
+) v
+WHERE sr.id = v.id
+''')
+
+_SQL_USER_VOTE = text('''
+SELECT vote_value FROM seller_review_vote
+WHERE user_id = :user_id AND review_id = :review_id
+''')
+
+_SQL_USER_VOTES_FOR_SELLER = text('''
+SELECT v.review_id, v.vote_value
+FROM seller_review_vote v
+JOIN seller_review sr ON sr.id = v.review_id
+WHERE v.user_id = :user_id AND sr.seller_id = :seller_id
+''')
+
+_SQL_VOTE_COUNTS = text('''
+SELECT upvotes, downvotes
+FROM seller_review
+WHERE id = :review_id
+''')
+
+_SQL_VOTE_COUNTS_BATCH = text('''
+SELECT id, upvotes, downvotes
+FROM seller_review
+WHERE id = ANY(:review_ids)
+''')
+
+
+# seller_id -> summary for a minute; entries are dropped when one of the
+# seller's reviews is written in this process
+_SUMMARY_CACHE = TTLCache(maxsize=10_000, ttl=60)
+
+
+def _invalidate_summary(seller_id):
+    _SUMMARY_CACHE.pop(seller_id, None)
+
+
+def get_recent_reviews_for_seller(seller_id, limit=5, sort='date', top_helpful=3):
+    """Return reviews about a seller with vote counts.
+
+    By default shows top 3 most helpful first, then remaining by date.
+    Helpfulness score = upvotes - downvotes.
+    """
+    return app.db.execute_mappings(
+        _SQL_RECENT_REVIEWS.get(sort, _SQL_RECENT_REVIEWS['date']),
+        seller_id=seller_id,
+        limit=limit,
+        top_helpful=int(top_helpful),
+    )
+
+
+def get_summary_for_seller(seller_id):
+    """Compute aggregate rating information for a seller (cached for a minute)."""
+    cached = _SUMMARY_CACHE.get(seller_id)
+    if cached is not None:
+        return cached
+
+    row = app.db.first(
+        _SQL_SUMMARY,
         seller_id=seller_id,
     )
-    if not rows:
+    if not row:
         return {
             'review_count': 0,
             'average_rating': None,
@@ -94,30 +203,26 @@ WHERE seller_id = :seller_id
             'last_review_at': None,
         }
 
-    row = rows[0]
     avg_rating = float(row[1]) if row[1] is not None else None
-    return {
+    summary = {
         'review_count': row[0] or 0,
         'average_rating': avg_rating,
         'first_review_at': row[2],
         'last_review_at': row[3],
     }
+    _SUMMARY_CACHE.set(seller_id, summary)
+    return summary
 
 
 def get_user_review_for_seller(user_id, seller_id):
     """Get a specific user's review for a seller, if it exists."""
-    rows = app.db.execute(
-        '''
-SELECT sr.id, sr.user_id, sr.seller_id, sr.rating, sr.body, sr.created_at, sr.updated_at
-FROM seller_review sr
-WHERE sr.user_id = :user_id AND sr.seller_id = :seller_id
-''',
+    row = app.db.first(
+        _SQL_USER_REVIEW,
         user_id=user_id,
         seller_id=seller_id,
     )
-    if not rows:
+    if not row:
         return None
-    row = rows[0]
     return {
         'id': row[0],
         'user_id': row[1],
@@ -129,76 +234,91 @@ WHERE sr.user_id = :user_id AND sr.seller_id = :seller_id
     }
 
 
+def get_user_reviews_for_sellers(user_id, seller_ids):
+    """Get a user's reviews for several sellers at once, keyed by seller_id."""
+    seller_ids = list(set(seller_ids))
+    if not seller_ids:
+        return {}
+    rows = app.db.execute(
+        _SQL_USER_REVIEWS_FOR_SELLERS,
+        user_id=user_id,
+        seller_ids=seller_ids,
+    )
+    return {
+        row[2]: {
+            'id': row[0],
+            'user_id': row[1],
+            'seller_id': row[2],
+            'rating': row[3],
+            'body': row[4],
+            'created_at': row[5],
+            'updated_at': row[6],
+        }
+        for row in rows
+    }
+
+
 def create_review(user_id, seller_id, rating, body):
     """Create a new seller review."""
     with app.db.engine.begin() as conn:
         result = conn.execute(
-            text('''
-INSERT INTO seller_review (user_id, seller_id, rating, body)
-VALUES (:user_id, :seller_id, :rating, :body)
-RETURNING id, created_at, updated_at
-'''),
+            _SQL_CREATE_REVIEW,
             {'user_id': user_id, 'seller_id': seller_id, 'rating': rating, 'body': body},
         ).first()
-        return {
-            'id': result[0],
-            'user_id': user_id,
-            'seller_id': seller_id,
-            'rating': rating,
-            'body': body,
-            'created_at': result[1],
-            'updated_at': result[2],
-        }
+    _invalidate_summary(seller_id)
+    return {
+        'id': result[0],
+        'user_id': user_id,
+        'seller_id': seller_id,
+        'rating': rating,
+        'body': body,
+        'created_at': result[1],
+        'updated_at': result[2],
+    }
 
 
 def update_review(review_id, rating, body):
     """Update an existing seller review."""
     with app.db.engine.begin() as conn:
         result = conn.execute(
-            text('''
-UPDATE seller_review
-SET rating = :rating, body = :body, updated_at = NOW()
-WHERE id = :review_id
-RETURNING id, user_id, seller_id, rating, body, created_at, updated_at
-'''),
+            _SQL_UPDATE_REVIEW,
             {'review_id': review_id, 'rating': rating, 'body': body},
         ).first()
-        if not result:
-            return None
-        return {
-            'id': result[0],
-            'user_id': result[1],
-            'seller_id': result[2],
-            'rating': result[3],
-            'body': result[4],
-            'created_at': result[5],
-            'updated_at': result[6],
-        }
+    if not result:
+        return None
+    _invalidate_summary(result[2])
+    return {
+        'id': result[0],
+        'user_id': result[1],
+        'seller_id': result[2],
+        'rating': result[3],
+        'body': result[4],
+        'created_at': result[5],
+        'updated_at': result[6],
+    }
 
 
 def delete_review(review_id):
     """Delete a seller review."""
     with app.db.engine.begin() as conn:
         result = conn.execute(
-            text('DELETE FROM seller_review WHERE id = :review_id RETURNING id'),
+            _SQL_DELETE_REVIEW,
             {'review_id': review_id},
         ).first()
-        return result is not None
+    if result is None:
+        return False
+    _invalidate_summary(result[1])
+    return True
 
 
 def get_review_by_id(review_id):
     """Get a review by its id."""
-    rows = app.db.execute(
-        '''
-SELECT id, user_id, seller_id, rating, body, created_at, updated_at
-FROM seller_review
-WHERE id = :review_id
-''',
+    row = app.db.first(
+        _SQL_REVIEW_BY_ID,
         review_id=review_id,
     )
-    if not rows:
+    if not row:
         return None
-    row = rows[0]
     return {
         'id': row[0],
         'user_id': row[1],
@@ -210,14 +330,23 @@ WHERE id = :review_id
     }
 
 
-def get_reviews_by_user(user_id, sort='date'):
-    """Get all seller reviews by a user, with seller info."""
-    order_clause = 'sr.created_at DESC'
-    if sort == 'rating':
-        order_clause = 'sr.rating DESC, sr.created_at DESC'
+# Keyset columns per sort, matching each ORDER BY (all DESC) so a row
+# comparison against the last-seen values picks up where the page ended.
+_REVIEWS_BY_USER_KEYS = {
+    'date': ('sr.created_at', 'sr.id'),
+    'rating': ('sr.rating', 'sr.created_at', 'sr.id'),
+}
 
-    rows = app.db.execute(
-        f'''
+
+@lru_cache(maxsize=2 * len(_REVIEWS_BY_USER_KEYS))
+def _reviews_by_user_statement(sort, with_cursor):
+    """Build the page statement for one sort, with or without a keyset cursor."""
+    keys = _REVIEWS_BY_USER_KEYS[sort]
+    cursor_clause = ''
+    if with_cursor:
+        params = ', '.join(f':cur_{i}' for i in range(len(keys)))
+        cursor_clause = f"AND ({', '.join(keys)}) < ({params})"
+    return text(f'''
 SELECT sr.id,
        sr.user_id,
        sr.seller_id,
@@ -229,23 +358,39 @@ SELECT sr.id,
 FROM seller_review sr
 JOIN users u ON u.id = sr.seller_id
 WHERE sr.user_id = :user_id
-ORDER BY {order_clause}
-''',
-        user_id=user_id,
+{cursor_clause}
+ORDER BY {', '.join(k + ' DESC' for k in keys)}
+LIMIT :limit
+''')
+
+
+def get_reviews_by_user(user_id, sort='date', limit=50, cursor=None):
+    """Get one page of seller reviews by a user, with seller info.
+
+    Returns {'reviews': [...], 'next_cursor': tuple or None}; pass next_cursor
+    back as cursor to fetch the following page.
+    """
+    sort = sort if sort in _REVIEWS_BY_USER_KEYS else 'date'
+    keys = _REVIEWS_BY_USER_KEYS[sort]
+    limit = max(1, min(100, int(limit)))
+    params = {'user_id': user_id, 'limit': limit}
+
+    with_cursor = cursor is not None and len(cursor) == len(keys)
+    if with_cursor:
+        params.update((f'cur_{i}', value) for i, value in enumerate(cursor))
+
+    reviews = app.db.execute_mappings(
+        _reviews_by_user_statement(sort, with_cursor),
+        **params,
     )
-    reviews = []
-    for row in rows:
-        reviews.append({
-            'id': row[0],
-            'user_id': row[1],
-            'seller_id': row[2],
-            'seller_name': row[3],
-            'rating': row[4],
-            'body': row[5],
-            'created_at': row[6],
-            'updated_at': row[7],
-        })
-    return reviews
+
+    next_cursor = None
+    if len(reviews) == limit:
+        last = reviews[-1]
+        next_cursor = (last['created_at'], last['id'])
+        if sort == 'rating':
+            next_cursor = (last['rating'],) + next_cursor
+    return {'reviews': reviews, 'next_cursor': next_cursor}
 
 
 def set_vote(user_id, review_id, vote_value):
@@ -253,46 +398,67 @@ def set_vote(user_id, review_id, vote_value):
     with app.db.engine.begin() as conn:
         if vote_value == 0:
             conn.execute(
-                text('''
-DELETE FROM seller_review_vote
-WHERE user_id = :user_id AND review_id = :review_id
-'''),
+                _SQL_DELETE_VOTE,
                 {'user_id': user_id, 'review_id': review_id},
             )
         else:
             conn.execute(
-                text('''
-INSERT INTO seller_review_vote (user_id, review_id, vote_value)
-VALUES (:user_id, :review_id, :vote_value)
-ON CONFLICT (user_id, review_id)
-DO UPDATE SET vote_value = :vote_value, created_at = NOW()
-'''),
+                _SQL_UPSERT_VOTE,
                 {'user_id': user_id, 'review_id': review_id, 'vote_value': vote_value},
             )
+        # Keep the denormalized counters on seller_review in step
+        conn.execute(
+            _SQL_REFRESH_VOTE_COUNTS,
+            {'review_id': review_id},
+        )
+
+
+def set_votes_bulk(user_id, votes):
+    """Apply several of a user's votes in one transaction.
+
+    votes: iterable of (review_id, vote_value) with the same values as set_vote;
+    the last entry wins if a review appears more than once.
+    """
+    latest = dict(votes)
+    if not latest:
+        return
+    cleared = [rid for rid, value in latest.items() if value == 0]
+    upserts = [(rid, value) for rid, value in latest.items() if value != 0]
+    with app.db.engine.begin() as conn:
+        if cleared:
+            conn.execute(
+                _SQL_DELETE_VOTES_BULK,
+                {'user_id': user_id, 'review_ids': cleared},
+            )
+        if upserts:
+            conn.execute(
+                _SQL_UPSERT_VOTES_BULK,
+                {
+                    'user_id': user_id,
+                    'review_ids': [rid for rid, _ in upserts],
+                    'vote_values': [value for _, value in upserts],
+                },
+            )
+        conn.execute(
+            _SQL_REFRESH_VOTE_COUNTS_BULK,
+            {'review_ids': list(latest)},
+        )
 
 
 def get_user_vote(user_id, review_id):
     """Get user's vote on a review. Returns 1, -1, or 0 (no vote)."""
-    rows = app.db.execute(
-        '''
-SELECT vote_value FROM seller_review_vote
-WHERE user_id = :user_id AND review_id = :review_id
-''',
+    row = app.db.first(
+        _SQL_USER_VOTE,
         user_id=user_id,
         review_id=review_id,
     )
-    return rows[0][0] if rows else 0
+    return row[0] if row else 0
 
 
 def get_user_votes_for_seller(user_id, seller_id):
     """Get dict of review_id -> vote_value for a seller."""
     rows = app.db.execute(
-        '''
-SELECT v.review_id, v.vote_value
-FROM seller_review_vote v
-JOIN seller_review sr ON sr.id = v.review_id
-WHERE v.user_id = :user_id AND sr.seller_id = :seller_id
-''',
+        _SQL_USER_VOTES_FOR_SELLER,
         user_id=user_id,
         seller_id=seller_id,
     )
@@ -300,17 +466,26 @@ WHERE v.user_id = :user_id AND sr.seller_id = :seller_id
 
 
 def get_vote_counts(review_id):
-    """Get upvote and downvote counts for a review."""
-    rows = app.db.execute(
-        '''
-SELECT
-    SUM(CASE WHEN vote_value = 1 THEN 1 ELSE 0 END) AS upvotes,
-    SUM(CASE WHEN vote_value = -1 THEN 1 ELSE 0 END) AS downvotes
-FROM seller_review_vote
-WHERE review_id = :review_id
-''',
+    """Get upvote and downvote counts for a review (kept current by set_vote)."""
+    row = app.db.first(
+        _SQL_VOTE_COUNTS,
         review_id=review_id,
     )
-    if rows and rows[0][0] is not None:
-        return {'upvotes': rows[0][0], 'downvotes': rows[0][1]}
+    if row:
+        return {'upvotes': row[0], 'downvotes': row[1]}
     return {'upvotes': 0, 'downvotes': 0}
+
+
+def get_vote_counts_for_reviews(review_ids):
+    """Get dict of review_id -> {'upvotes', 'downvotes'} for several reviews in one query."""
+    review_ids = list(set(review_ids))
+    counts = {rid: {'upvotes': 0, 'downvotes': 0} for rid in review_ids}
+    if not review_ids:
+        return counts
+    rows = app.db.execute(
+        _SQL_VOTE_COUNTS_BATCH,
+        review_ids=review_ids,
+    )
+    for row in rows:
+        counts[row[0]] = {'upvotes': row[1], 'downvotes': row[2]}
+    return counts
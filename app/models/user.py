@@ -1,9 +1,123 @@
 from flask import current_app as app
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from app.cache import per_request_cache
+
+
+_SQL_GET = text('''
+SELECT id, email, full_name, address, created_at
+FROM Users
+WHERE id = :id
+''')
+
+_SQL_GET_WITH_PASSWORD = text('''
+SELECT id, email, full_name, address, created_at, password_hash
+FROM Users
+WHERE LOWER(email) = LOWER(:email)
+''')
+
+_SQL_CREATE = text('''
+INSERT INTO Users (email, full_name, address, password_hash)
+VALUES (:email, :full_name, :address, :password_hash)
+ON CONFLICT (LOWER(email)) DO NOTHING
+RETURNING id
+''')
+
+_SQL_UPDATE_PROFILE = text('''
+UPDATE Users
+SET full_name = :full_name,
+    address = :address
+WHERE id = :user_id
+RETURNING id
+''')
+
+_SQL_UPDATE_PROFILE_WITH_EMAIL = text('''
+UPDATE Users
+SET full_name = :full_name,
+    address = :address,
+    email = :email
+WHERE id = :user_id
+RETURNING id
+''')
+
+_SQL_UPDATE_PASSWORD = text('''
+UPDATE Users
+SET password_hash = :password_hash
+WHERE id = :user_id
+RETURNING id
+''')
+
+_SQL_GET_BALANCE = text('''
+SELECT balance_cents
+FROM account_balance
+WHERE user_id = :user_id
+''')
+
+_SQL_DEPOSIT = text('''
+WITH bal AS (
+    INSERT INTO account_balance (user_id, balance_cents)
+    VALUES (:user_id, :delta_cents)
+    ON CONFLICT (user_id)
+    DO UPDATE SET balance_cents = account_balance.balance_cents + EXCLUDED.balance_cents
+    RETURNING balance_cents
+), tx AS (
+    INSERT INTO balance_tx (user_id, amount_cents, note)
+    VALUES (:user_id, :delta_cents, :note)
+)
+SELECT balance_cents FROM bal
+''')
+
+_SQL_WITHDRAW = text('''
+WITH bal AS (
+    UPDATE account_balance
+    SET balance_cents = balance_cents + :delta_cents
+    WHERE user_id = :user_id
+    RETURNING balance_cents
+), tx AS (
+    INSERT INTO balance_tx (user_id, amount_cents, note)
+    SELECT :user_id, :delta_cents, :note
+    FROM bal
+)
+SELECT balance_cents FROM bal
+''')
+
+_SQL_BALANCE_HISTORY = text('''
+SELECT created_at, amount_cents, note
+FROM balance_tx
+WHERE user_id = :user_id
+ORDER BY created_at DESC
+''')
+
+
+def hash_password(password_plaintext):
+    """Hash a password with the configured PASSWORD_HASH_METHOD."""
+    return generate_password_hash(
+        password_plaintext,
+        method=app.config['PASSWORD_HASH_METHOD'],
+    )
+
+
+# Postgres SQLSTATE for a failed CHECK constraint
+_CHECK_VIOLATION = '23514'
+
+_DECOY_HASH = None
+
+
+def check_decoy_password(password_plaintext):
+    """Run one hash check against a decoy so a missing account takes as long
+    to reject as a wrong password (no email enumeration by timing)."""
+    global _DECOY_HASH
+    if _DECOY_HASH is None:
+        # Built lazily with the configured method so its cost matches real hashes
+        _DECOY_HASH = hash_password('!decoy!')
+    check_password_hash(_DECOY_HASH, password_plaintext)
+
 
 class User:
+    __slots__ = ('id', 'email', 'full_name', 'address', 'created_at')
+
     def __init__(self, id, email, full_name, address, created_at):
         self.id = id
         self.email = email
@@ -15,52 +129,18 @@ class User:
     def firstname(self):
         if not self.full_name:
             return ''
-        return self.full_name.split()[0]
-
-    @staticmethod
-    def get_with_password(email):
-        rows = app.db.execute(
-            """
-SELECT id, email, full_name, address, created_at, password_hash
-FROM Users
-WHERE email = :email
-""",
-            email=email,
-        )
-        if not rows:
-            return None
-        row = rows[0]
-        user = User(row[0], row[1], row[2], row[3], row[4])
-        password_hash = row[5]
-        return user, password_hash
-
-    @staticmethod
-    def email_exists(email, exclude_user_id=None):
-        query = """
-SELECT 1
-FROM Users
-WHERE email = :email
-"""
-        params = {'email': email}
-        if exclude_user_id is not None:
-            query += " AND id <> :exclude_user_id"
-            params['exclude_user_id'] = exclude_user_id
-
-        rows = app.db.execute(query, **params)
-        return len(rows) > 0
+        # partition stops at the first space instead of splitting every token
+        return self.full_name.lstrip().partition(' ')[0]
 
     @staticmethod
     def create(email, full_name, address, password_plaintext):
+        """Insert a user; returns None if the email (case-insensitively) is taken."""
         rows = app.db.execute(
-            """
-INSERT INTO Users (email, full_name, address, password_hash)
-VALUES (:email, :full_name, :address, :password_hash)
-RETURNING id
-""",
+            _SQL_CREATE,
             email=email,
             full_name=full_name,
             address=address,
-            password_hash=generate_password_hash(password_plaintext),
+            password_hash=hash_password(password_plaintext),
         )
         return User.get(rows[0][0]) if rows else None
 
@@ -71,55 +151,39 @@ RETURNING id
             'address': address,
             'user_id': user_id,
         }
-        email_clause = ''
+        stmt = _SQL_UPDATE_PROFILE
         if email is not None:
-            email_clause = ", email = :email"
+            stmt = _SQL_UPDATE_PROFILE_WITH_EMAIL
             params['email'] = email
 
-        rows = app.db.execute(
-            f"""
-UPDATE Users
-SET full_name = :full_name,
-    address = :address{email_clause}
-WHERE id = :user_id
-RETURNING id
-""",
-            **params,
-        )
+        rows = app.db.execute(stmt, **params)
+        User.get.invalidate(user_id)
         return len(rows) == 1
 
     @staticmethod
+    @per_request_cache
     def get(id):
         rows = app.db.execute(
-            """
-SELECT id, email, full_name, address, created_at
-FROM Users
-WHERE id = :id
-""",
+            _SQL_GET,
             id=id,
         )
         return User(*rows[0]) if rows else None
 
     @staticmethod
     def authenticate(email, password_plaintext):
-        result = User.get_with_password(email)
-        if not result:
+        row = app.db.first(_SQL_GET_WITH_PASSWORD, email=email)
+        if row is None:
+            check_decoy_password(password_plaintext)
             return None
-        user, password_hash = result
-        if not check_password_hash(password_hash, password_plaintext):
+        if not check_password_hash(row[5], password_plaintext):
             return None
-        return user
+        return User(*row[:5])
 
     @staticmethod
     def update_password(user_id, new_password_plaintext):
         rows = app.db.execute(
-            """
-UPDATE Users
-SET password_hash = :password_hash
-WHERE id = :user_id
-RETURNING id
-""",
-            password_hash=generate_password_hash(new_password_plaintext),
+            _SQL_UPDATE_PASSWORD,
+            password_hash=hash_password(new_password_plaintext),
             user_id=user_id,
         )
         return len(rows) == 1
@@ -127,11 +191,7 @@ RETURNING id
     @staticmethod
     def get_balance(user_id):
         rows = app.db.execute(
-            """
-SELECT balance_cents
-FROM account_balance
-WHERE user_id = :user_id
-""",
+            _SQL_GET_BALANCE,
             user_id=user_id,
         )
         return rows[0][0] if rows else 0
@@ -141,70 +201,35 @@ WHERE user_id = :user_id
         if delta_cents == 0:
             return User.get_balance(user_id)
 
-        with app.db.engine.begin() as conn:
-            conn.execute(
-                text(
-                    """
-INSERT INTO account_balance (user_id, balance_cents)
-VALUES (:user_id, 0)
-ON CONFLICT (user_id) DO NOTHING
-"""
-                ),
-                {'user_id': user_id},
-            )
-
-            balance_row = conn.execute(
-                text(
-                    """
-SELECT balance_cents
-FROM account_balance
-WHERE user_id = :user_id
-FOR UPDATE
-"""
-                ),
-                {'user_id': user_id},
-            ).first()
-
-            current_balance = balance_row[0] if balance_row else 0
-            new_balance = current_balance + delta_cents
-            if new_balance < 0:
-                raise ValueError('Insufficient funds')
-
-            conn.execute(
-                text(
-                    """
-UPDATE account_balance
-SET balance_cents = :new_balance
-WHERE user_id = :user_id
-"""
-                ),
-                {'new_balance': new_balance, 'user_id': user_id},
-            )
-            conn.execute(
-                text(
-                    """
-INSERT INTO balance_tx (user_id, amount_cents, note)
-VALUES (:user_id, :amount_cents, :note)
-"""
-                ),
-                {
-                    'user_id': user_id,
-                    'amount_cents': delta_cents,
-                    'note': note or '',
-                },
-            )
-
-        return new_balance
+        # Balance change and ledger row in one round trip. Deposits upsert;
+        # withdrawals only UPDATE an existing row, since a negative INSERT
+        # would trip account_balance_nonnegative before ON CONFLICT applies.
+        # The CHECK then rejects overdrafts atomically.
+        statement = _SQL_DEPOSIT if delta_cents > 0 else _SQL_WITHDRAW
+        try:
+            with app.db.engine.begin() as conn:
+                row = conn.execute(
+                    statement,
+                    {
+                        'user_id': user_id,
+                        'delta_cents': delta_cents,
+                        'note': note or '',
+                    },
+                ).first()
+        except IntegrityError as e:
+            if getattr(e.orig, 'pgcode', None) == _CHECK_VIOLATION:
+                raise ValueError('Insufficient funds') from e
+            raise
+
+        if row is None:
+            # No balance row yet: nothing to withdraw from
+            raise ValueError('Insufficient funds')
+        return row[0]
 
     @staticmethod
     def get_balance_history(user_id):
         rows = app.db.execute(
-            """
-SELECT created_at, amount_cents, note
-FROM balance_tx
-WHERE user_id = :user_id
-ORDER BY created_at DESC
-""",
+            _SQL_BALANCE_HISTORY,
             user_id=user_id,
         )
         return [
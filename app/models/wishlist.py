@@ -1,7 +1,42 @@
 from flask import current_app as app
+from sqlalchemy import text
+
+from app.models.product import Product
+
+
+_SQL_GET = text('''
+SELECT id, uid, pid, time_added
+FROM Wishes
+WHERE id = :id
+''')
+
+_SQL_GET_ALL_BY_UID = text('''
+SELECT id, uid, pid, time_added
+FROM Wishes
+WHERE uid = :uid
+ORDER BY time_added DESC
+''')
+
+_SQL_GET_ALL_BY_UID_WITH_PRODUCTS = text('''
+SELECT w.id, w.uid, w.pid, w.time_added,
+       p.id, p.name, p.price, p.available, p.avg_rating
+FROM Wishes w
+JOIN Products p ON p.id = w.pid
+WHERE w.uid = :uid
+ORDER BY w.time_added DESC
+''')
+
+_SQL_ADD = text('''
+INSERT INTO Wishes(uid, pid)
+VALUES (:uid, :pid)
+RETURNING id, uid, pid, time_added
+''')
 
 
 class WishlistItem:
+    # Built in bulk from result rows; slots skip the per-instance __dict__
+    __slots__ = ('id', 'uid', 'pid', 'time_added')
+
     def __init__(self, id, uid, pid, time_added):
         self.id = id
         self.uid = uid
@@ -19,11 +54,7 @@ class WishlistItem:
     @staticmethod
     def get(id):
         rows = app.db.execute(
-            '''
-SELECT id, uid, pid, time_added
-FROM Wishes
-WHERE id = :id
-''',
+            _SQL_GET,
             id=id,
         )
         return WishlistItem(*rows[0]) if rows else None
@@ -31,24 +62,24 @@ WHERE id = :id
     @staticmethod
     def get_all_by_uid(uid):
         rows = app.db.execute(
-            '''
-SELECT id, uid, pid, time_added
-FROM Wishes
-WHERE uid = :uid
-ORDER BY time_added DESC
-''',
+            _SQL_GET_ALL_BY_UID,
             uid=uid,
         )
         return [WishlistItem(*row) for row in rows]
 
+    @staticmethod
+    def get_all_by_uid_with_products(uid):
+        """Wishlist rows joined to their products; returns (WishlistItem, Product) pairs."""
+        rows = app.db.execute(
+            _SQL_GET_ALL_BY_UID_WITH_PRODUCTS,
+            uid=uid,
+        )
+        return [(WishlistItem(*row[:4]), Product(*row[4:])) for row in rows]
+
     @staticmethod
     def add(uid, pid):
         rows = app.db.execute(
-            '''
-INSERT INTO Wishes(uid, pid)
-VALUES (:uid, :pid)
-RETURNING id, uid, pid, time_added
-''',
+            _SQL_ADD,
             uid=uid,
             pid=pid,
         )
@@ -1,9 +1,60 @@
-from flask import Blueprint, request, jsonify, render_template, abort, current_app
-from app.models.product import Product
+from flask import Blueprint, request, jsonify, render_template, abort, current_app, g, url_for
+from werkzeug.exceptions import HTTPException
+from app.models.product import LIST_CACHE, Product
 from app.models import product_review
 from app.models import purchases
 
 bp = Blueprint('products', __name__)
+MAX_FILTER_PAGE_SIZE = 500
+
+
+def _serialize_product(p):
+    """The one JSON shape every product list endpoint emits."""
+    return {
+        "id": p.id,
+        "name": p.name,
+        "price": p.price,
+        "available": p.available,
+        "image_url": p.image_url,
+        "description": p.description,
+        "avg_rating": float(p.average_rating) if p.average_rating is not None else None,
+    }
+
+
+@bp.errorhandler(Exception)
+def _api_error(e):
+    """Unexpected errors in the product API views come back as JSON 500s;
+    HTTP errors and non-API pages keep Flask's usual handling."""
+    if isinstance(e, HTTPException):
+        return e
+    if not request.path.startswith('/api/'):
+        raise e
+    current_app.logger.exception("%s error", request.endpoint)
+    return jsonify({"error": str(e)}), 500
+
+
+# Catalog listings change on the order of minutes; let browsers and proxies reuse them
+_LIST_CACHE_CONTROL = 'public, max-age=30, s-maxage=60'
+
+
+def _cacheable(resp):
+    """Mark a buffered list response cacheable and give it an ETag so repeat
+    requests can be answered with 304 Not Modified."""
+    resp.headers['Cache-Control'] = _LIST_CACHE_CONTROL
+    resp.add_etag()
+    resp.make_conditional(request)
+    return resp
+
+
+def _cached_payload(key, build):
+    """Return the serialized list for key from the product list cache,
+    calling build() to produce (and cache) it on a miss."""
+    payload = LIST_CACHE.get(key)
+    if payload is None:
+        payload = build()
+        LIST_CACHE.set(key, payload)
+    return payload
+
 
 @bp.route('/top-products')
 def top_products():
@@ -19,31 +70,16 @@ def top_k_products():
     Returns the top-k most expensive products.
     Example: /api/products/topk?k=5
     """
-    try:
-        k = request.args.get('k', default=5, type=int)
-        if k < 1:
-            k = 1
-
-        products = Product.get_top_k_expensive(k) if hasattr(Product, 'get_top_k_expensive') else (Product.get_all()[:k] if hasattr(Product, 'get_all') else [])
-
-        output = []
-        for p in products:
-            # try to get average rating via product_review summary
-            summary = product_review.get_summary_for_product(p.id) if hasattr(product_review, 'get_summary_for_product') else {}
-            avg = summary.get('avg_rating') or summary.get('avg') or getattr(p, 'average_rating', None)
-            output.append({
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "available": p.available,
-                "image_url": getattr(p, "image_url", None),
-                "description": getattr(p, "description", None),
-                "avg_rating": avg
-            })
-        return jsonify(output)
-    except Exception as e:
-        current_app.logger.exception("top_k_products error")
-        return jsonify({"error": str(e)}), 500
+    k = request.args.get('k', default=5, type=int)
+    if k < 1:
+        k = 1
+
+    # avg_rating comes from the products row (kept current by a trigger)
+    payload = _cached_payload(
+        ('topk', k),
+        lambda: [_serialize_product(p) for p in Product.get_top_k_expensive(k)],
+    )
+    return _cacheable(jsonify(payload))
 
 
 @bp.route('/api/products/search')
@@ -52,36 +88,15 @@ def search_products():
     Search products by name substring (case-insensitive).
     Example: /api/products/search?q=Candy
     """
-    try:
-        q = request.args.get('q', '').strip()
-        if not q:
-            return jsonify([])
-
-        products = []
-        if hasattr(Product, 'search_by_name'):
-            products = Product.search_by_name(q)
-        else:
-            allp = Product.get_all(available=True) if hasattr(Product, 'get_all') else []
-            qlow = q.lower()
-            products = [p for p in allp if qlow in (p.name or '').lower()]
-
-        output = []
-        for p in products:
-            summary = product_review.get_summary_for_product(p.id) if hasattr(product_review, 'get_summary_for_product') else {}
-            avg = summary.get('avg') or summary.get('avg_rating') or getattr(p, 'average_rating', None)
-            output.append({
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "available": p.available,
-                "image_url": getattr(p, "image_url", None),
-                "description": getattr(p, "description", None),
-                "avg_rating": avg
-            })
-        return jsonify(output)
-    except Exception as e:
-        current_app.logger.exception("search_products error")
-        return jsonify({"error": str(e)}), 500
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify([])
+
+    payload = _cached_payload(
+        ('search', q),
+        lambda: [_serialize_product(p) for p in Product.search_by_name(q)],
+    )
+    return _cacheable(jsonify(payload))
 
 
 @bp.route('/api/products/available')
@@ -89,28 +104,11 @@ def available_products():
     """
     Return only available products (used by frontend 'Available Only').
     """
-    try:
-        # Prefer model helper if exists
-        if hasattr(Product, 'get_all'):
-            products = Product.get_all(available=True)
-        else:
-            products = [p for p in (Product.get_all() if hasattr(Product, 'get_all') else []) if p.available]
-
-        output = []
-        for p in products:
-            output.append({
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "available": p.available,
-                "image_url": getattr(p, "image_url", None),
-                "description": getattr(p, "description", None),
-                "avg_rating": getattr(p, "average_rating", None)
-            })
-        return jsonify(output)
-    except Exception as e:
-        current_app.logger.exception("available_products error")
-        return jsonify({"error": str(e)}), 500
+    payload = _cached_payload(
+        ('available',),
+        lambda: [_serialize_product(p) for p in Product.get_all(available=True)],
+    )
+    return _cacheable(jsonify(payload))
 
 
 @bp.route('/api/products/filter')
@@ -118,70 +116,31 @@ def filter_products():
     """
     Return products sorted/filtered by a `sort` param:
       sort = price_high | price_low | az | za | rating | available_only | availability
-    Example: /api/products/filter?sort=rating
+    Optional `limit` / `offset` return a single page (default: every product).
+    Example: /api/products/filter?sort=rating&limit=50&offset=100
     """
-    try:
-        sort = request.args.get('sort', 'price_high')
-
-        # Fetch products from model (default to get_all True if available param)
-        if hasattr(Product, 'get_all'):
-            # default show all available products for list endpoints unless explicitly intended otherwise
-            products = Product.get_all(available=True)
-        else:
-            products = []
-
-        # Precompute avg ratings map used for sorting by rating and for output
-        avg_map = {}
-        for p in products:
-            summary = product_review.get_summary_for_product(p.id) if hasattr(product_review, 'get_summary_for_product') else {}
-            avg = summary.get('avg') or summary.get('avg_rating') or getattr(p, 'average_rating', None)
-            try:
-                avg_map[p.id] = float(avg) if avg is not None else None
-            except Exception:
-                avg_map[p.id] = None
-
-        # Sorting & Filtering
-        if sort == "az":
-            products = sorted(products, key=lambda p: (p.name or '').lower())
-        elif sort == "za":
-            products = sorted(products, key=lambda p: (p.name or '').lower(), reverse=True)
-        elif sort == "price_low":
-            products = sorted(products, key=lambda p: float(p.price) if p.price is not None else 0)
-        elif sort == "price_high":
-            products = sorted(products, key=lambda p: float(p.price) if p.price is not None else 0, reverse=True)
-        elif sort == "rating":
-            products = sorted(products, key=lambda p: (avg_map.get(p.id) is None, -(avg_map.get(p.id) or 0)))
-        elif sort == "available_only":
-            products = [p for p in products if p.available]
-        elif sort == "availability":
-            # In-stock first, tiebreaker by name
-            products = sorted(products, key=lambda p: (not p.available, (p.name or '').lower()))
-        else:
-            # default fallback: price_high
-            products = sorted(products, key=lambda p: float(p.price) if p.price is not None else 0, reverse=True)
-
-        # Build JSON output
-        output = []
-        for p in products:
-            output.append({
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "available": p.available,
-                "image_url": getattr(p, "image_url", None),
-                "description": getattr(p, "description", None),
-                "avg_rating": avg_map.get(p.id)
-            })
-        return jsonify(output)
-    except Exception as e:
-        current_app.logger.exception("filter_products error")
-        return jsonify({"error": str(e)}), 500
+    sort = request.args.get('sort', 'price_high')
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(MAX_FILTER_PAGE_SIZE, limit))
+    offset = max(0, request.args.get('offset', default=0, type=int))
+
+    # Ordering and paging happen in SQL against the denormalized
+    # products.avg_rating column, so there is no per-product summary lookup or Python sort
+    payload = _cached_payload(
+        ('filter', sort, limit, offset),
+        lambda: [
+            _serialize_product(p)
+            for p in Product.list_sorted(sort, limit=limit, offset=offset, available=True)
+        ],
+    )
+    return _cacheable(jsonify(payload))
 
 
 @bp.route('/products/<int:product_id>')
 def product_detail(product_id):
     """Simple product detail page (uses Product.get which now returns image & description)"""
-    product = Product.get(product_id) if hasattr(Product, 'get') else None
+    product = Product.get(product_id)
     if not product:
         abort(404)
     return render_template('product_detail.html', product=product)
@@ -189,8 +148,41 @@ def product_detail(product_id):
 
 @bp.route('/products/<int:product_id>/reviews')
 def product_reviews(product_id):
-    product = Product.get(product_id) if hasattr(Product, 'get') else None
+    product = Product.get(product_id)
     if not product:
         abort(404)
-    reviews = product_review.get_recent_reviews_for_product(product_id) if hasattr(product_review, 'get_recent_reviews_for_product') else []
-    return render_template("product_reviews.html", product=product, reviews=reviews)
+
+    sort = request.args.get('sort', 'date')
+    reviews, summary = product_review.get_reviews_and_summary_for_product(
+        product_id, limit=20, sort=sort
+    )
+
+    user_review = None
+    review_url = None
+    can_review = False
+    user_votes = {}
+
+    if g.user:
+        user_review = product_review.get_user_review_for_product(g.user.id, product_id)
+        order_info = purchases.get_user_order_with_product(g.user.id, product_id)
+        if order_info:
+            can_review = True
+            review_url = url_for(
+                'account.review_product',
+                order_id=order_info['order_id'],
+                product_id=product_id,
+            )
+        # One query for every review's vote instead of a lookup per row
+        user_votes = product_review.get_user_votes_for_product(g.user.id, product_id)
+
+    return render_template(
+        "product_reviews.html",
+        product=product,
+        summary=summary,
+        reviews=reviews,
+        current_sort=sort,
+        user_review=user_review,
+        review_url=review_url,
+        can_review=can_review,
+        user_votes=user_votes,
+    )
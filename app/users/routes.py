@@ -43,10 +43,11 @@ from flask import (
     url_for,
 )
 from sqlalchemy import text
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import check_password_hash
 
 from app.models import seller_review
 from app.models import purchases
+from app.models.user import User, check_decoy_password, hash_password
 
 bp = Blueprint('users', __name__, template_folder='templates')
 
@@ -93,7 +94,7 @@ def _get_user_by_email(email: str) -> Optional[Tuple[Any, ...]]:
         """
 SELECT id, password_hash
 FROM Users
-WHERE email = :email
+WHERE LOWER(email) = LOWER(:email)
 """,
         email=email,
     )
@@ -281,18 +282,13 @@ def api_register():
         return jsonify({'errors': errors}), 400
 
     with current_app.db.engine.begin() as conn:
-        existing = conn.execute(
-            text("SELECT 1 FROM Users WHERE email = :email"),
-            {'email': email},
-        ).first()
-        if existing:
-            return jsonify({'errors': ['email already registered']}), 400
-
+        # ON CONFLICT against idx_users_email_lower replaces a separate existence check
         created = conn.execute(
             text(
                 """
 INSERT INTO Users (email, full_name, address, password_hash)
 VALUES (:email, :full_name, :address, :password_hash)
+ON CONFLICT (LOWER(email)) DO NOTHING
 RETURNING id
 """
             ),
@@ -300,11 +296,11 @@ RETURNING id
                 'email': email,
                 'full_name': full_name,
                 'address': address,
-                'password_hash': generate_password_hash(password),
+                'password_hash': hash_password(password),
             },
         ).first()
         if not created:
-            return jsonify({'errors': ['could not create user']}), 400
+            return jsonify({'errors': ['email already registered']}), 400
 
         user_id = created[0]
         conn.execute(
@@ -333,6 +329,7 @@ def api_login():
 
     user_row = _get_user_by_email(email)
     if not user_row:
+        check_decoy_password(password)
         return jsonify({'error': 'invalid credentials'}), 401
     user_id, password_hash = user_row
 
@@ -391,7 +388,7 @@ def api_update_profile():
                 """
 SELECT 1
 FROM Users
-WHERE email = :email AND id <> :user_id
+WHERE LOWER(email) = LOWER(:email) AND id <> :user_id
 """,
                 email=candidate,
                 user_id=user_id,
@@ -423,7 +420,7 @@ WHERE email = :email AND id <> :user_id
         if not old_password or not check_password_hash(current_hash, old_password):
             return jsonify({'error': 'old_password incorrect'}), 401
         updates.append('password_hash = :password_hash')
-        params['password_hash'] = generate_password_hash(new_password)
+        params['password_hash'] = hash_password(new_password)
 
     if not updates:
         balance_cents = _get_balance_cents(user_id)
@@ -470,39 +467,8 @@ def api_top_up():
     if not isinstance(amount, int) or amount <= 0:
         return jsonify({'error': 'amount_cents must be a positive integer'}), 400
 
-    with current_app.db.engine.begin() as conn:
-        conn.execute(
-            text(
-                """
-INSERT INTO account_balance (user_id, balance_cents)
-VALUES (:user_id, 0)
-ON CONFLICT (user_id) DO NOTHING
-"""
-            ),
-            {'user_id': user_id},
-        )
-        updated = conn.execute(
-            text(
-                """
-UPDATE account_balance
-SET balance_cents = balance_cents + :amount
-WHERE user_id = :user_id
-RETURNING balance_cents
-"""
-            ),
-            {'amount': amount, 'user_id': user_id},
-        ).first()
-        conn.execute(
-            text(
-                """
-INSERT INTO balance_tx (user_id, amount_cents, note)
-VALUES (:user_id, :amount_cents, 'top up')
-"""
-            ),
-            {'user_id': user_id, 'amount_cents': amount},
-        )
-
-    balance_cents = updated[0] if updated else _get_balance_cents(user_id)
+    # Single-statement upsert + ledger insert (see User.adjust_balance)
+    balance_cents = User.adjust_balance(user_id, amount, note='top up')
     return jsonify({'balance_cents': balance_cents})
 
 
@@ -515,44 +481,12 @@ def api_withdraw():
     if not isinstance(amount, int) or amount <= 0:
         return jsonify({'error': 'amount_cents must be a positive integer'}), 400
 
-    with current_app.db.engine.begin() as conn:
-        balance_row = conn.execute(
-            text(
-                """
-SELECT balance_cents
-FROM account_balance
-WHERE user_id = :user_id
-FOR UPDATE
-"""
-            ),
-            {'user_id': user_id},
-        ).first()
-        current_balance = balance_row[0] if balance_row else 0
-        if amount > current_balance:
-            return jsonify({'error': 'insufficient balance'}), 400
-
-        updated = conn.execute(
-            text(
-                """
-UPDATE account_balance
-SET balance_cents = balance_cents - :amount
-WHERE user_id = :user_id
-RETURNING balance_cents
-"""
-            ),
-            {'amount': amount, 'user_id': user_id},
-        ).first()
-        conn.execute(
-            text(
-                """
-INSERT INTO balance_tx (user_id, amount_cents, note)
-VALUES (:user_id, :amount_cents, 'withdraw')
-"""
-            ),
-            {'user_id': user_id, 'amount_cents': -amount},
-        )
-
-    balance_cents = updated[0] if updated else _get_balance_cents(user_id)
+    # adjust_balance's UPDATE row-locks the balance until commit, and the
+    # account_balance_nonnegative CHECK rejects overdrafts
+    try:
+        balance_cents = User.adjust_balance(user_id, -amount, note='withdraw')
+    except ValueError:
+        return jsonify({'error': 'insufficient balance'}), 400
     return jsonify({'balance_cents': balance_cents})
 
 
@@ -603,12 +537,16 @@ def api_user_purchases(user_id: int):
     offset = (page - 1) * per_page
 
     filter_kwargs, _ = _build_purchase_filters()
-    result = purchases.get_purchases_for_user(
-        user_id,
-        limit=per_page,
-        offset=offset,
-        **filter_kwargs,
-    )
+    try:
+        result = purchases.get_purchases_for_user(
+            user_id,
+            limit=per_page,
+            offset=offset,
+            after=request.args.get('after') or None,
+            **filter_kwargs,
+        )
+    except ValueError:
+        return jsonify({'error': 'invalid cursor'}), 400
     total = result['total_orders']
     serialized = [_serialize_purchase(order) for order in result['orders']]
     return jsonify(
@@ -616,6 +554,7 @@ def api_user_purchases(user_id: int):
             'page': page,
             'per_page': per_page,
             'total': total,
+            'next_cursor': result['next_cursor'],
             'items': serialized,
         }
     )
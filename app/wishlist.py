@@ -25,7 +25,8 @@ def humanize_time(dt):
 def wishlist():
     if not g.get('user'):
         return redirect(url_for('account.login'))
-    items = WishlistItem.get_all_by_uid(g.user.id)
+    # Product details come back in the same query as the wishlist rows
+    items = WishlistItem.get_all_by_uid_with_products(g.user.id)
     return render_template('wishlist.html',
                           items=items,
                           humanize_time=humanize_time)
@@ -1,4 +1,10 @@
 
+create extension if not exists pg_trgm;
+
+drop function if exists submit_order_sp(int);
+drop function if exists refresh_order_rollup() cascade;
+drop function if exists refresh_product_rating() cascade;
+drop view if exists cart_checkout_lines;
 drop table if exists product_review_vote cascade;
 drop table if exists seller_review_vote cascade;
 drop table if exists cartitem cascade;
@@ -17,7 +23,7 @@ drop table if exists users cascade;
 
 create table users (
     id int not null primary key generated by default as identity,
-    email text unique not null,
+    email text not null,
     full_name text not null,
     address text not null,
     password_hash text not null,
@@ -28,7 +34,8 @@ create table users (
 
 create table account_balance (
     user_id int primary key references users(id) on delete cascade,
-    balance_cents bigint not null default 0
+    balance_cents bigint not null default 0,
+    constraint account_balance_nonnegative check (balance_cents >= 0)
 );
 
 create table balance_tx (
@@ -43,7 +50,11 @@ create table products (
     id int not null primary key generated by default as identity,
     name text unique not null,
     price decimal(12,2) not null,
-    available boolean default true
+    price_cents bigint generated always as ((price * 100)::bigint) stored,
+    available boolean default true,
+    -- denormalized from product_review by the refresh_product_rating trigger
+    avg_rating numeric(3,2),
+    review_count int not null default 0
 );
 
 create table orders (
@@ -51,6 +62,9 @@ create table orders (
     buyer_id int references users(id) on delete set null,
     created_at timestamptz not null default now(),
     total_cents bigint not null,
+    -- rolled up from order_items by the refresh_order_rollup trigger:
+    -- line count, and whether every line has been fulfilled
+    item_count int not null default 0,
     fulfilled boolean not null default false
 );
 
@@ -61,6 +75,7 @@ create table order_items (
     seller_id int,
     quantity int not null check (quantity > 0),
     unit_price_cents bigint not null check (unit_price_cents >= 0),
+    line_total_cents bigint generated always as (quantity::bigint * unit_price_cents) stored,
     fulfilled_at timestamptz
 );
 
@@ -93,6 +108,10 @@ create table seller_review (
     body text,
     created_at timestamptz not null default now(),
     updated_at timestamptz not null default now(),
+    -- denormalized from seller_review_vote; refreshed on every vote change
+    upvotes int not null default 0,
+    downvotes int not null default 0,
+    helpful_score int generated always as (upvotes - downvotes) stored,
     constraint unique_user_seller unique (user_id, seller_id)
 );
 
@@ -104,6 +123,9 @@ create table product_review (
     body text,
     created_at timestamptz not null default now(),
     updated_at timestamptz not null default now(),
+    -- denormalized from product_review_vote; refreshed on every vote change
+    upvotes int not null default 0,
+    downvotes int not null default 0,
     constraint unique_user_product unique (user_id, product_id)
 );
 
@@ -139,10 +161,247 @@ create table seller_review_vote (
 );
 
 -- Indexes to keep purchase lookups fast under pagination/filtering
-CREATE INDEX IF NOT EXISTS idx_orders_buyer_created ON orders (buyer_id, created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);
-CREATE INDEX IF NOT EXISTS idx_order_items_seller_id ON order_items (seller_id);
+CREATE INDEX IF NOT EXISTS idx_orders_buyer_created ON orders (buyer_id, created_at DESC, id DESC) INCLUDE (total_cents, item_count, fulfilled);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id) INCLUDE (id, product_id, seller_id, quantity, unit_price_cents, line_total_cents, fulfilled_at);
+CREATE INDEX IF NOT EXISTS idx_order_items_seller_order ON order_items (seller_id, order_id);
+-- Emails are unique case-insensitively; also serves the LOWER(email) login lookups
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower ON users (LOWER(email));
 CREATE INDEX IF NOT EXISTS idx_products_name_lower ON products (LOWER(name));
-CREATE INDEX IF NOT EXISTS idx_product_review_vote_review ON product_review_vote (review_id);
-CREATE INDEX IF NOT EXISTS idx_seller_review_vote_review ON seller_review_vote (review_id);
+-- Trigram indexes let the '%term%' ILIKE name filters use a bitmap index scan
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_full_name_trgm ON users USING gin (full_name gin_trgm_ops);
+-- Covers get_top_k_expensive's select list, so top-k is an index-only scan of k entries
+CREATE INDEX IF NOT EXISTS idx_products_price_available ON products (price DESC) INCLUDE (id, name, available, avg_rating) WHERE available = TRUE;
+CREATE INDEX IF NOT EXISTS idx_products_available_rating ON products (avg_rating DESC NULLS LAST, id) WHERE available = TRUE;
+CREATE INDEX IF NOT EXISTS idx_products_available_featured ON products (id) INCLUDE (name, price, available, avg_rating) WHERE available = TRUE;
+CREATE INDEX IF NOT EXISTS idx_product_review_product_created ON product_review (product_id, created_at DESC) INCLUDE (user_id, rating);
+CREATE INDEX IF NOT EXISTS idx_product_review_user_created ON product_review (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_seller_review_user_created ON seller_review (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_product_review_vote_review ON product_review_vote (review_id, vote_value);
+CREATE INDEX IF NOT EXISTS idx_seller_review_vote_review ON seller_review_vote (review_id, vote_value);
+CREATE INDEX IF NOT EXISTS idx_seller_review_seller_helpful ON seller_review (seller_id, helpful_score DESC, created_at DESC);
+
+-- Cart lookups: one cart per user, one row per product within a cart
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user ON cart (user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cartitem_cart_product ON cartitem (cart_id, product_id);
+-- Checkout seller pick (largest stock per product) without touching the heap
+CREATE INDEX IF NOT EXISTS idx_inventory_product_quantity ON inventory (product_id, quantity DESC) INCLUDE (user_id);
+
+-- Each cart line paired with the seller holding the most stock of that product
+-- (never the buyer); seller_id is NULL when no one can cover the quantity.
+CREATE VIEW cart_checkout_lines AS
+SELECT c.user_id AS buyer_id,
+       c.id AS cart_id,
+       ci.id AS cart_item_id,
+       ci.product_id,
+       p.name,
+       ci.quantity,
+       p.price_cents AS unit_price_cents,
+       s.seller_id
+FROM cartitem ci
+JOIN cart c ON c.id = ci.cart_id
+JOIN products p ON p.id = ci.product_id
+LEFT JOIN LATERAL (
+    SELECT i.user_id AS seller_id
+    FROM inventory i
+    WHERE i.product_id = ci.product_id
+      AND i.quantity >= ci.quantity
+      AND i.user_id <> c.user_id
+    ORDER BY i.quantity DESC
+    LIMIT 1
+) s ON TRUE;
+
+-- Checkout in one round trip: validate the cart, create the order and its
+-- line items, move stock and money, then empty the cart. Validation failures
+-- come back in error_message with nothing written.
+CREATE FUNCTION submit_order_sp(
+    p_buyer_id INT,
+    OUT new_order_id INT,
+    OUT error_message TEXT
+) AS $$
+DECLARE
+    v_cart_id INT;
+    v_line_count INT;
+    v_total_cents BIGINT;
+    v_unsold_name TEXT;
+    v_balance_cents BIGINT;
+    v_sold_rows INT;
+    v_moved_rows INT;
+BEGIN
+    SELECT MIN(cart_id),
+           COUNT(*),
+           COALESCE(SUM(unit_price_cents * quantity), 0),
+           (ARRAY_AGG(name ORDER BY cart_item_id) FILTER (WHERE seller_id IS NULL))[1]
+    INTO v_cart_id, v_line_count, v_total_cents, v_unsold_name
+    FROM cart_checkout_lines
+    WHERE buyer_id = p_buyer_id;
+
+    IF v_line_count = 0 THEN
+        error_message := 'Cart is empty';
+        RETURN;
+    END IF;
+    IF v_unsold_name IS NOT NULL THEN
+        error_message := format('No seller with sufficient inventory for ''%s''', v_unsold_name);
+        RETURN;
+    END IF;
+
+    SELECT balance_cents INTO v_balance_cents
+    FROM account_balance
+    WHERE user_id = p_buyer_id
+    FOR UPDATE;
+    IF COALESCE(v_balance_cents, 0) < v_total_cents THEN
+        error_message := 'Insufficient balance.';
+        RETURN;
+    END IF;
+
+    -- Stock may have moved since the seller pick; a line whose seller can no
+    -- longer cover it aborts the block and rolls every write below back.
+    BEGIN
+        INSERT INTO orders (buyer_id, total_cents, fulfilled)
+        VALUES (p_buyer_id, v_total_cents, FALSE)
+        RETURNING id INTO new_order_id;
+
+        INSERT INTO order_items (order_id, product_id, seller_id, quantity, unit_price_cents)
+        SELECT new_order_id, product_id, seller_id, quantity, unit_price_cents
+        FROM cart_checkout_lines
+        WHERE buyer_id = p_buyer_id
+        ORDER BY cart_item_id;
+
+        -- Seller payouts come straight back from the stock update, so the
+        -- order lines are read once for both.
+        WITH sold AS (
+            SELECT seller_id, product_id,
+                   SUM(quantity) AS quantity,
+                   SUM(line_total_cents) AS amount_cents
+            FROM order_items
+            WHERE order_id = new_order_id
+            GROUP BY seller_id, product_id
+        ), moved AS (
+            UPDATE inventory i
+            SET quantity = i.quantity - sold.quantity
+            FROM sold
+            WHERE i.user_id = sold.seller_id
+              AND i.product_id = sold.product_id
+              AND i.quantity >= sold.quantity
+            RETURNING i.user_id AS seller_id, sold.amount_cents
+        ), earnings AS (
+            SELECT seller_id, SUM(amount_cents) AS amount_cents
+            FROM moved
+            GROUP BY seller_id
+        ), credited AS (
+            INSERT INTO account_balance (user_id, balance_cents)
+            SELECT seller_id, amount_cents FROM earnings
+            ON CONFLICT (user_id)
+            DO UPDATE SET balance_cents = account_balance.balance_cents + EXCLUDED.balance_cents
+        ), logged AS (
+            INSERT INTO balance_tx (user_id, amount_cents, note)
+            SELECT seller_id, amount_cents, format('Sale (order #%s)', new_order_id)
+            FROM earnings
+        )
+        SELECT (SELECT COUNT(*) FROM sold), (SELECT COUNT(*) FROM moved)
+        INTO v_sold_rows, v_moved_rows;
+
+        IF v_moved_rows < v_sold_rows THEN
+            RAISE EXCEPTION 'inventory changed during checkout';
+        END IF;
+
+        UPDATE account_balance
+        SET balance_cents = balance_cents - v_total_cents
+        WHERE user_id = p_buyer_id;
+        INSERT INTO balance_tx (user_id, amount_cents, note)
+        VALUES (p_buyer_id, -v_total_cents, format('Order #%s', new_order_id));
+
+        DELETE FROM cartitem WHERE cart_id = v_cart_id;
+    EXCEPTION WHEN raise_exception THEN
+        new_order_id := NULL;
+        error_message := 'Inventory changed while placing the order. Please try again.';
+    END;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep orders.item_count / orders.fulfilled in step with their line items so
+-- order listings read them instead of aggregating order_items per page.
+CREATE FUNCTION refresh_order_rollup() RETURNS trigger AS $$
+DECLARE
+    v_order_ids INT[];
+BEGIN
+    -- Statement-level: roll up each touched order once, whichever side of an
+    -- UPDATE (old or new order_id) it appears on.
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT order_id) INTO v_order_ids FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT order_id) INTO v_order_ids FROM old_rows;
+    ELSE
+        SELECT array_agg(order_id) INTO v_order_ids
+        FROM (SELECT order_id FROM old_rows
+              UNION
+              SELECT order_id FROM new_rows) ids;
+    END IF;
+
+    UPDATE orders o
+    SET item_count = r.item_count,
+        fulfilled = r.fulfilled
+    FROM (
+        SELECT ids.order_id,
+               COUNT(oi.id) AS item_count,
+               COALESCE(BOOL_AND(oi.fulfilled_at IS NOT NULL), FALSE) AS fulfilled
+        FROM unnest(v_order_ids) AS ids(order_id)
+        LEFT JOIN order_items oi ON oi.order_id = ids.order_id
+        GROUP BY ids.order_id
+    ) r
+    WHERE o.id = r.order_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables rule out multi-event triggers and UPDATE OF column lists,
+-- so each event gets its own statement-level trigger.
+CREATE TRIGGER order_items_rollup_insert
+AFTER INSERT ON order_items
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_rollup();
+
+CREATE TRIGGER order_items_rollup_update
+AFTER UPDATE ON order_items
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_rollup();
+
+CREATE TRIGGER order_items_rollup_delete
+AFTER DELETE ON order_items
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_rollup();
+
+-- Keep products.avg_rating / products.review_count in step with product_review
+-- so product listings read them instead of aggregating reviews per request.
+CREATE FUNCTION refresh_product_rating() RETURNS trigger AS $$
+DECLARE
+    v_product_ids INT[] := CASE TG_OP
+        WHEN 'INSERT' THEN ARRAY[NEW.product_id]
+        WHEN 'DELETE' THEN ARRAY[OLD.product_id]
+        WHEN 'UPDATE' THEN
+            CASE WHEN OLD.product_id = NEW.product_id
+                 THEN ARRAY[NEW.product_id]
+                 ELSE ARRAY[OLD.product_id, NEW.product_id]
+            END
+    END;
+BEGIN
+    UPDATE products p
+    SET avg_rating = s.avg_rating,
+        review_count = s.review_count
+    FROM (
+        SELECT ids.product_id,
+               AVG(pr.rating)::numeric(3,2) AS avg_rating,
+               COUNT(pr.id) AS review_count
+        FROM unnest(v_product_ids) AS ids(product_id)
+        LEFT JOIN product_review pr ON pr.product_id = ids.product_id
+        GROUP BY ids.product_id
+    ) s
+    WHERE p.id = s.product_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER product_review_rating
+AFTER INSERT OR DELETE OR UPDATE OF product_id, rating ON product_review
+FOR EACH ROW EXECUTE FUNCTION refresh_product_rating();
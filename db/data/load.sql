@@ -23,6 +23,8 @@ SELECT pg_catalog.setval('public.orders_id_seq',
                          COALESCE((SELECT MAX(id)+1 FROM orders), 1),
                          false);
 
+-- The statement-level rollup triggers fill orders.item_count / fulfilled
+-- in a single pass over the copied rows
 \COPY order_items (id, order_id, product_id, seller_id, quantity, unit_price_cents, fulfilled_at) FROM 'OrderItems.csv' WITH (FORMAT csv, HEADER false, DELIMITER ',', NULL '');
 SELECT pg_catalog.setval('public.order_items_id_seq',
                          COALESCE((SELECT MAX(id)+1 FROM order_items), 1),
@@ -43,11 +45,45 @@ SELECT pg_catalog.setval('public.seller_review_id_seq',
                          COALESCE((SELECT MAX(id)+1 FROM seller_review), 1),
                          false);
 
+-- Bulk load without the per-row rating trigger, then aggregate once
+ALTER TABLE product_review DISABLE TRIGGER product_review_rating;
 \COPY product_review (id, user_id, product_id, rating, body, created_at, updated_at) FROM 'ProductReviews.csv' WITH (FORMAT csv, HEADER false, DELIMITER ',', NULL '');
 SELECT pg_catalog.setval('public.product_review_id_seq',
                          COALESCE((SELECT MAX(id)+1 FROM product_review), 1),
                          false);
+ALTER TABLE product_review ENABLE TRIGGER product_review_rating;
+
+UPDATE products p
+SET avg_rating = s.avg_rating, review_count = s.review_count
+FROM (
+    SELECT product_id, AVG(rating)::numeric(3,2) AS avg_rating, COUNT(*) AS review_count
+    FROM product_review
+    GROUP BY product_id
+) s
+WHERE p.id = s.product_id;
 
 \COPY product_review_vote (user_id, review_id, vote_value, created_at) FROM 'ProductReviewVotes.csv' WITH (FORMAT csv, HEADER false, DELIMITER ',', NULL '');
 
+UPDATE product_review pr
+SET upvotes = v.upvotes, downvotes = v.downvotes
+FROM (
+    SELECT review_id,
+           COUNT(*) FILTER (WHERE vote_value = 1) AS upvotes,
+           COUNT(*) FILTER (WHERE vote_value = -1) AS downvotes
+    FROM product_review_vote
+    GROUP BY review_id
+) v
+WHERE pr.id = v.review_id;
+
 \COPY seller_review_vote (user_id, review_id, vote_value, created_at) FROM 'SellerReviewVotes.csv' WITH (FORMAT csv, HEADER false, DELIMITER ',', NULL '');
+
+UPDATE seller_review sr
+SET upvotes = v.upvotes, downvotes = v.downvotes
+FROM (
+    SELECT review_id,
+           COUNT(*) FILTER (WHERE vote_value = 1) AS upvotes,
+           COUNT(*) FILTER (WHERE vote_value = -1) AS downvotes
+    FROM seller_review_vote
+    GROUP BY review_id
+) v
+WHERE sr.id = v.review_id;